@@ -1,20 +1,88 @@
+import asyncio
+import json
+import logging
 import os
+import sys
+import time
+from contextlib import asynccontextmanager
 
-import boto3
-from fastapi import FastAPI, HTTPException
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
 from pydantic import BaseModel
-import httpx
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from farmwise import http_clients, metrics
+from farmwise.batch import anthropic_record, batch_job_status, submit_batch_job
+from farmwise.budgets import BudgetRejected, token_usage
+from farmwise.components import BEDROCK_REGION, MODEL_ID, AppComponents
+from farmwise.logs import configure_logging, log_event
+from farmwise.rate_limit import BATCH, at_priority, request_priority
+from farmwise.response_cache import normalize_prompt, wants_fresh, weather_bucket
+from farmwise.routing import classify, error_code
+from farmwise.sessions import with_summary
+from farmwise.single_flight import SingleFlight
+from farmwise.sse import sse_event
 
 load_dotenv(dotenv_path='.env')
+configure_logging()
+
+# Number of Bedrock calls allowed to run at the same time; the rest queue up
+BEDROCK_MAX_CONCURRENCY = int(os.getenv("BEDROCK_MAX_CONCURRENCY", "8"))
 
-# Initialize the Claude model through AWS Bedrock
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name="us-west-2",  # Choose the region where your Bedrock model is deployed
+# Most model calls all /batch requests together may have in flight at once; always leaves at least
+# one of the BEDROCK_MAX_CONCURRENCY worker slots free for interactive requests
+BATCH_MAX_CONCURRENCY = max(1, min(int(os.getenv("BATCH_MAX_CONCURRENCY", "4")), BEDROCK_MAX_CONCURRENCY - 1))
+
+# S3 bucket and IAM role used by offline (Bedrock batch inference) jobs
+BATCH_S3_BUCKET = os.getenv("BATCH_S3_BUCKET")
+BATCH_ROLE_ARN = os.getenv("BATCH_ROLE_ARN")
+
+# Bedrock gateway and router, retrieval index, weather, geocoder, caches and session memory, configured
+# from the same environment variables as the web app (see farmwise/components.py)
+components = AppComponents(
+    "backend",
+    os.path.dirname(os.path.abspath(__file__)),
+    max_concurrency=BEDROCK_MAX_CONCURRENCY,
+    temperature=0.5,
+    weather_providers="openweathermap,open-meteo,weatherstack",
 )
+bedrock_gateway = components.bedrock_gateway
+model_invoker = components.model_invoker
+model_router = components.model_router
+knowledge_index = components.knowledge_index
+answer_budgets = components.budgets
+weather_cache = components.weather_cache
+weather_service = components.weather_service
+weather_prefetcher = components.weather_prefetcher
+geocoder = components.geocoder
+response_cache = components.response_cache
+conversation_memory = components.conversation_memory
+
+ADVISOR_PROMPT = components.advisor_prompt
+BRIEF_ADVISOR_PROMPT = components.brief_advisor_prompt
+WEATHER_DEADLINE = components.weather_deadline
+
+# Shared by every /batch request, so concurrent batches can't fill the invoker between them
+batch_slots = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+# Identical prompts arriving while the same answer is still being generated share that generation
+in_flight = SingleFlight()
+
+metrics.register_cache("in_flight", in_flight)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    components.start()
+    yield
+    await components.aclose()
+    await http_clients.aclose()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 
 class PromptInput(BaseModel):
@@ -22,113 +90,407 @@ class PromptInput(BaseModel):
     lat: str | None = None
     lon: str | None = None
     location: str | None = None
+    session_id: str | None = None
+    brief: bool = False
+    max_tokens: int | None = None
+    stop: list[str] | None = None
+
+
+class BatchInput(BaseModel):
+    items: list[PromptInput]
+    offline: bool = False
 
 @app.post("/")
-async def entry(item: PromptInput):
-    print("Got called")
-    stripped_string = item.prompt.strip()
-    print(stripped_string)
+async def entry(item: PromptInput, request: Request, response: Response):
+    started = time.perf_counter()
+    text_message, cache_hit, usage = await answer_prompt(item, use_cache=not wants_fresh(request.headers))
+    response.headers["X-Cache"] = "HIT" if cache_hit else "MISS"
+    log_event(
+        "chat", endpoint="/", cache_hit=cache_hit, brief=item.brief, output_tokens=usage["output_tokens"],
+        total_ms=round((time.perf_counter() - started) * 1000),
+    )
+    return {
+        "message": text_message,
+        "usage": usage,
+    }
 
 
-    # TODO:> For now set lat and lon hardcoded if it does not exist
-    lat = item.lat or "38.9241"
-    lon = item.lon or "-94.7315"
-    location = item.location
+@app.post("/batch")
+async def batch(batch_input: BatchInput, request: Request):
+    """
+    Answers many prompts in one call and streams results back as NDJSON, one
+    `{"index": ..., "message": ..., "usage": ...}` (or `"error"`) line per prompt in completion order.
+
+    Weather is fetched once per geo cell, and batch model calls (across all
+    batches) run at most `BATCH_MAX_CONCURRENCY` at a time so batches can't crowd out interactive traffic.
+    With `offline: true` the prompts are submitted as a Bedrock batch inference job instead
+    (see submit_offline_batch).
+    """
+    items = batch_input.items
+    if not items:
+        raise HTTPException(status_code=400, detail="Batch is empty")
+
+    if batch_input.offline:
+        return await submit_offline_batch(items)
+
+    # Warm the weather cache once per cell; the per-item lookups below then hit it
+    farms = await asyncio.gather(*(coordinates(item) for item in items))
+    cells = {weather_cache.key_for(lat, lon): (lat, lon) for lat, lon in filter(None, farms)}
+    await asyncio.gather(*(fetch_weather_with_deadline(lat, lon) for lat, lon in cells.values()))
 
-    if stripped_string:
-        weather_json = await fetch_weather_data_from_api(lat, lon)
+    use_cache = not wants_fresh(request.headers)
 
-        print(weather_json)
-        temperature = weather_json["main"]["temp"]
-        wind_speed = weather_json["wind"]["speed"]
-        humidity = weather_json["main"]["humidity"]
-        print(temperature, wind_speed, humidity)
+    async def run(index, item):
+        async with batch_slots:
+            try:
+                # Batch items queue behind interactive chat when a model is rate limited
+                with request_priority(BATCH):
+                    text_message, _, usage = await answer_prompt(item, use_cache=use_cache)
+            except HTTPException as exc:
+                return {"index": index, "error": exc.detail}
+            except Exception as exc:
+                return {"index": index, "error": str(exc)}
+        return {"index": index, "message": text_message, "usage": usage}
 
-        temperature_info_string = "Given my temperature is {} fahrenheit, humidity is {} and my windspeed is {} miles per hour".format(temperature, humidity, wind_speed)
-        final_generated_string = stripped_string + temperature_info_string
+    async def lines():
+        tasks = [asyncio.create_task(run(index, item)) for index, item in enumerate(items)]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
 
-        text_message = chat(user_message=final_generated_string)
-        return {
-            "message": text_message
-        }
-    raise HTTPException(status_code=404, detail="Prompt is empty")
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
-def chat(user_message: str):
+def batch_job_error(exc):
     """
-    API endpoint for handling chat requests.
-    Receives a system prompt and user message, returns model response.
+    Maps a Bedrock or S3 error from an offline batch call to an HTTPException.
+    """
+    code = error_code(exc)
+    detail = f"Batch job request failed: {code or exc}"
+    if code in ("ValidationException", "ResourceNotFoundException"):
+        return HTTPException(status_code=404 if code == "ResourceNotFoundException" else 400, detail=detail)
+    # Missing bucket, role or permissions are our configuration, not the caller's request
+    return HTTPException(status_code=502, detail=detail)
+
+
+async def submit_offline_batch(items):
+    """
+    Submits the prompts as a Bedrock batch inference job and returns its ARN,
+    with the index and reason of every item left out of it.
+
+    The job may run hours later, so prompts carry only weather already in
+    the cache instead of waiting on a live lookup for every item.
     """
+    if not (BATCH_S3_BUCKET and BATCH_ROLE_ARN):
+        raise HTTPException(status_code=501, detail="Offline batches need BATCH_S3_BUCKET and BATCH_ROLE_ARN")
 
-    system_prompt = [{"text": """You are an expert agricultural advisor with deep knowledge in crop management, disease diagnosis, and soil health. You will assist farmers by providing detailed, step-by-step guidance using Chain of Thought reasoning. You will also apply few-shot learning by learning from a few provided examples to give accurate and actionable advice. Your goal is to ensure that farmers understand the reasoning behind each recommendation and provide them with clear, actionable steps for improving their crops' health and yield.
+    records = []
+    skipped = []
+    for index, item in enumerate(items):
+        try:
+            budget = budget_for(item)
+            final_generated_string, _ = await build_user_message(item, live_weather=False)
+        except HTTPException as exc:
+            skipped.append({"index": index, "error": exc.detail})
+            continue
+        prompt = BRIEF_ADVISOR_PROMPT if budget.brief else ADVISOR_PROMPT
+        references = prompt.context(references=components.references(item.prompt, budget.brief))
+        system_text = f"{prompt.static_text}\n\n{references}" if references else prompt.static_text
+        records.append(anthropic_record(
+            str(index), system_text, final_generated_string,
+            max_tokens=budget.max_tokens, stop_sequences=budget.stop_sequences,
+        ))
 
-    Instructions:
-    - For every query, break down your reasoning process step-by-step.
-    - Always explain the logic behind your recommendations in simple terms.
-    - Use examples where necessary to enhance understanding.
-    - Provide holistic advice, considering factors like soil type, weather conditions, and common crop diseases.
+    if not records:
+        raise HTTPException(status_code=400, detail={"error": "No valid prompts in batch", "skipped": skipped})
 
-    Example 1:
-    Farmer's Query: "What crops can I grow in sandy soil?"
-    Claude's Response:
-    1. Sandy soil drains water quickly and tends to dry out faster than other types of soil. This means crops that thrive in well-drained soil are ideal.
-    2. Crops like carrots, potatoes, and peanuts have roots that can handle the faster water drainage and nutrient leaching that occurs in sandy soil.
-    3. It’s important to note that sandy soil often lacks nutrients, so regular fertilization will be necessary to maintain healthy crops.
-    Recommendation: I suggest growing carrots, potatoes, or peanuts, but remember to supplement the soil with organic matter and fertilizers to enhance its nutrient content.
+    try:
+        job_arn = await asyncio.to_thread(
+            submit_batch_job, records, MODEL_ID, BATCH_S3_BUCKET, BATCH_ROLE_ARN, BEDROCK_REGION
+        )
+    except (BotoCoreError, ClientError) as exc:
+        raise batch_job_error(exc)
+    return {"job_arn": job_arn, "records": len(records), "skipped": skipped}
 
-    Example 2:
-    Farmer's Query: "How should I treat yellow spots on my tomato plants?"
-    Claude's Response:
-    1. Yellow spots on tomato leaves are often a sign of fungal diseases, such as early blight or septoria leaf spot.
-    2. To confirm, check if the spots have a yellow halo or if they are starting to brown in the center. If yes, it is likely early blight.
-    3. Treatment involves removing the affected leaves and applying a copper-based fungicide. Improving airflow around the plants and avoiding overhead watering can also prevent the spread.
-    Recommendation: Based on your description, I would recommend using a copper-based fungicide and ensuring your tomato plants are pruned for better airflow. Also, avoid getting the leaves wet when watering to reduce further spread of the disease.
 
-    Example 3:
-    Farmer's Query: "Should I water my crops today if it's going to rain tomorrow?"
-    Claude's Response:
-    1. It’s important to consider both the current soil moisture and the upcoming weather forecast.
-    2. If the soil is still moist from previous irrigation, and rain is expected tomorrow, it may be better to hold off on watering to avoid over-saturating the soil, which could lead to root rot.
-    3. However, if the soil is dry and the rain forecast is uncertain, providing a light watering could be beneficial to prevent plant stress.
-    Recommendation: I suggest checking the soil moisture. If it's still moist, wait until after the rain. If it's dry and you're unsure about the rain, give the plants a light watering.
+@app.get("/batch/status")
+async def batch_status(job_arn: str):
+    try:
+        return await asyncio.to_thread(batch_job_status, job_arn, BEDROCK_REGION)
+    except (BotoCoreError, ClientError) as exc:
+        raise batch_job_error(exc)
 
+
+def budget_for(item: PromptInput):
+    """
+    Returns the request's GenerationBudget; an invalid `max_tokens` or `stop` is a 400.
     """
-                      }]
+    try:
+        return answer_budgets.resolve(item.brief, item.max_tokens, item.stop)
+    except BudgetRejected as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
 
-    message = {
-        "role": "user",
-        "content": [{"text": user_message}]
-    }
 
-    text_response = generate_conversation(system_prompt, [message])
-    return text_response
+async def answer_prompt(item: PromptInput, use_cache: bool = True):
+    """
+    Returns the model's answer to one prompt, whether it came from the response cache
+    and the tokens this request used. Cache misses (and bypassed lookups) refresh the stored answer.
+    """
+    budget = budget_for(item)
+    final_generated_string, cache_context = await build_user_message(item)
+    # Brief and otherwise trimmed answers are cached (and coalesced) apart from full ones
+    cache_context = (*cache_context, budget.variant)
+    summary, history = conversation_memory.context(item.session_id) if item.session_id else ("", [])
+    # Follow-ups depend on the conversation so far, so they never go through the response cache
+    cacheable = not (summary or history)
+
+    text_message = response_cache.get(item.prompt, cache_context) if use_cache and cacheable else None
+    cache_hit = text_message is not None
+    task = classify(item.prompt)
+    usage = token_usage()
+    if cacheable and not cache_hit:
+
+        async def generate():
+            result = await model_invoker.run(
+                chat, user_message=final_generated_string, task=task, question=item.prompt, budget=budget
+            )
+            # Only the request leading the flight spent these tokens; requests joining it report none
+            usage.update(token_usage(result))
+            return result.text
+
+        text_message = await in_flight.run(
+            flight_key(item.prompt, cache_context, task),
+            generate,
+            on_complete=lambda text: response_cache.put(item.prompt, cache_context, text),
+        )
+    elif not cache_hit:
+        result = await model_invoker.run(
+            chat, user_message=final_generated_string, task=task, summary=summary, history=history,
+            question=item.prompt, budget=budget,
+        )
+        text_message, usage = result.text, token_usage(result)
+    remember(item, text_message)
+    return text_message, cache_hit, usage
+
+
+def flight_key(prompt: str, cache_context, task: str):
+    """
+    Requests are coalesced by normalized prompt, geo cell and weather bucket, and the request class
+    that picks their model. Keying on the class rather than asking the router for a model keeps
+    the key from using up a degraded model's half-open probe.
+    """
+    return normalize_prompt(prompt), cache_context, task
+
+
+def remember(item: PromptInput, text_message: str):
+    """
+    Adds the exchange to the session's history in the background; compaction may call the model.
+    """
+    if item.session_id:
+        asyncio.get_running_loop().run_in_executor(
+            None, at_priority, BATCH, conversation_memory.record, item.session_id, item.prompt.strip(), text_message
+        )
 
 
-def generate_conversation(system_prompts, messages):
+@app.post("/stream")
+async def entry_stream(item: PromptInput, request: Request):
     """
-    Sends messages to the Claude model on AWS Bedrock and returns the response.
+    Same as `POST /` but streams the answer back as Server-Sent Events, one
+    `data: {"text": ...}` message per generated chunk followed by a `done` event
+    carrying the tokens used.
     """
-    model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-    temperature = 0.5
+    budget = budget_for(item)
+    final_generated_string, cache_context = await build_user_message(item)
+    cache_context = (*cache_context, budget.variant)
+    summary, history = conversation_memory.context(item.session_id) if item.session_id else ("", [])
+    cacheable = not (summary or history)
+    cached = None
+    if cacheable and not wants_fresh(request.headers):
+        cached = response_cache.get(item.prompt, cache_context)
 
-    inference_config = {"temperature": temperature}
+    async def events():
+        if cached is not None:
+            remember(item, cached)
+            yield sse_event({"text": cached})
+            yield sse_event({"usage": token_usage()}, event="done")
+            return
+        task = classify(item.prompt)
+        # Filled in when this request's own generation finishes; stays zero for one that joined another's
+        usage = token_usage()
+        if cacheable:
+            # Joins an identical generation already in flight, replaying what it has sent so far
+            chunk_stream = in_flight.stream(
+                flight_key(item.prompt, cache_context, task),
+                lambda: model_invoker.stream(
+                    chat_stream, user_message=final_generated_string, task=task, question=item.prompt,
+                    budget=budget, usage=usage,
+                ),
+                on_complete=lambda text: response_cache.put(item.prompt, cache_context, text),
+            )
+        else:
+            chunk_stream = model_invoker.stream(
+                chat_stream, user_message=final_generated_string, task=task, summary=summary, history=history,
+                question=item.prompt, budget=budget, usage=usage,
+            )
+        chunks = []
+        try:
+            async for text in chunk_stream:
+                chunks.append(text)
+                yield sse_event({"text": text})
+        except Exception as exc:
+            yield sse_event({"error": str(exc)}, event="error")
+            return
+        remember(item, "".join(chunks))
+        yield sse_event({"usage": usage}, event="done")
 
-    # Send the message
-    response = bedrock_runtime.converse(
-        modelId=model_id,
-        messages=messages,
-        system=system_prompts,
-        inferenceConfig=inference_config,
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"X-Cache": "HIT" if cached is not None else "MISS"}
     )
 
-    # Extract the response content
-    text_response = response["output"]["message"]["content"][0]["text"]
-    return text_response
+
+async def coordinates(item: PromptInput):
+    """
+    Returns the farm's (lat, lon): as sent, else geocoded from `location`, else the default farm.
+    Returns None for a location that can't be resolved within WEATHER_DEADLINE.
+    """
+    if item.lat and item.lon:
+        return item.lat, item.lon
+    if item.location:
+        try:
+            # A slow upstream lookup keeps running in the background and is remembered for next time
+            place = await asyncio.wait_for(asyncio.shield(geocoder.aresolve(item.location)), WEATHER_DEADLINE)
+        except asyncio.TimeoutError:
+            place = None
+        return (str(place.lat), str(place.lon)) if place else None
+    # TODO:> For now set lat and lon hardcoded if it does not exist
+    return item.lat or "38.9241", item.lon or "-94.7315"
+
+
+async def build_user_message(item: PromptInput, live_weather: bool = True):
+    """
+    Appends the current weather at the farm to the farmer's prompt.
+
+    Also returns the coarse context (geo cell and weather bucket) the answer
+    can be cached under. Without `live_weather` only cached (or stale)
+    conditions are used and no weather provider is called.
+    """
+    stripped_string = item.prompt.strip()
+    if not stripped_string:
+        raise HTTPException(status_code=404, detail="Prompt is empty")
+
+    # Everything else here is string formatting; the location and weather waits are the prompt-build time
+    with metrics.PROMPT_BUILD_SECONDS.labels("backend").time():
+        farm = await coordinates(item)
+        if farm is None:
+            cell, weather = weather_cache.key_for(location=item.location), None
+        else:
+            cell = weather_cache.key_for(*farm)
+            weather = await fetch_weather_with_deadline(*farm) if live_weather else weather_cache.stale(cell)
+    if weather is None:
+        return stripped_string + " Current weather data is unavailable.", (cell, None)
+
+    temperature = weather.temperature_f
+    wind_speed = weather.wind_mph
+    humidity = weather.humidity
+
+    temperature_info_string = "Given my temperature is {} fahrenheit, humidity is {}".format(temperature, humidity)
+    if wind_speed is not None:
+        temperature_info_string += " and my windspeed is {} miles per hour".format(wind_speed)
+    temperature_info_string += weather.age_note(weather_cache.ttl)
+    return stripped_string + temperature_info_string, (cell, weather_bucket(temperature, humidity, wind_speed))
+
+
+async def fetch_weather_with_deadline(lat: str, lon: str):
+    """
+    Returns current weather (a farmwise.weather.Weather), or None if it is not available
+    within WEATHER_DEADLINE seconds and there are no stale conditions to fall back on.
+    On timeout the lookup keeps running in the background so it still warms the cache.
+    """
+    task = asyncio.ensure_future(fetch_weather_data(lat, lon))
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), WEATHER_DEADLINE)
+    except Exception as exc:
+        log_event("weather_unavailable", level=logging.WARNING, lat=lat, lon=lon, error=repr(exc))
+        return weather_cache.stale(weather_cache.key_for(lat, lon))
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "model": model_invoker.stats(),
+        "models": bedrock_gateway.stats(),
+        "routing": model_router.stats(),
+        "weather": weather_service.stats(),
+        "weather_cache": weather_cache.stats(),
+        "weather_prefetch": weather_prefetcher.stats(),
+        "geocoder": geocoder.stats(),
+        "retrieval": knowledge_index.stats(),
+        "response_cache": response_cache.stats(),
+        "in_flight": in_flight.stats(),
+        "sessions": conversation_memory.stats(),
+    }
 
 
-# invoke weather api
-async def fetch_weather_data_from_api(lat: str, lon: str):
-    api_key = os.getenv("OPEN_WEATHER_API")
-    async with httpx.AsyncClient() as client:
-        response = await client.get("https://api.openweathermap.org/data/2.5/weather?lat={}&lon={}&appid={}&units=imperial".format(lat,lon,api_key))
-    return response.json()
\ No newline at end of file
+# Run with several uvicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory so each scrape covers them all
+@app.get("/metrics")
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+
+def chat(user_message: str, task: str = "diagnostic", summary: str = "", history=(), question: str = "",
+         budget=None):
+    """
+    API endpoint for handling chat requests.
+    Receives a system prompt and user message, returns the model's ModelResult.
+    `task` is the request class used to pick a model (see farmwise.routing.classify);
+    `summary` and `history` carry the earlier conversation, if any, and `question`
+    (the farmer's own words, without the weather) selects the reference material.
+    `budget` (a GenerationBudget) caps the answer; it defaults to a full answer.
+    """
+    budget = budget or answer_budgets.resolve()
+    system_prompt, messages = build_chat_prompt(user_message, summary, history, question, budget.brief)
+    return components.converse(system_prompt, messages, task, budget)
+
+
+def chat_stream(user_message: str, task: str = "diagnostic", summary: str = "", history=(), question: str = "",
+                budget=None, usage=None):
+    """
+    Streaming counterpart of `chat`; yields the model response chunk by chunk
+    and fills in the `usage` dict, if given, once it is done.
+    """
+    budget = budget or answer_budgets.resolve()
+    system_prompt, messages = build_chat_prompt(user_message, summary, history, question, budget.brief)
+    yield from components.converse_stream(system_prompt, messages, task, budget, usage)
+
+
+def build_chat_prompt(user_message: str, summary: str = "", history=(), question: str = "", brief: bool = False):
+    """
+    Returns the system prompt and message list for a farmer's question,
+    following on from the earlier turns of the conversation.
+    """
+    prompt = BRIEF_ADVISOR_PROMPT if brief else ADVISOR_PROMPT
+    references = components.references(question or user_message, brief)
+    system_prompt = prompt.converse_system(cache=True, references=references)
+    message = {
+        "role": "user",
+        "content": [{"text": user_message}]
+    }
+
+    return with_summary(system_prompt, summary), [*history, message]
+
+
+async def fetch_weather_data(lat: str, lon: str):
+    """
+    Returns current weather for the coordinates, served from the cache when possible.
+    The cell is registered for background refresh.
+    """
+    key = weather_cache.key_for(lat=lat, lon=lon)
+    # Providers raise on error payloads (bad key, rate limited), so only real conditions get cached
+    fetch = lambda: weather_service.current(lat=lat, lon=lon)
+    weather_prefetcher.register(key, fetch)
+    return await weather_cache.aget_or_fetch(key, fetch)
@@ -1,221 +1,509 @@
 import os
+import sys
 import json
-import requests
-import base64
-from flask import Flask, request, jsonify
-import boto3
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.datastructures import UploadFile
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from farmwise import http_clients, metrics
+from farmwise.admission import AdmissionControl
+from farmwise.budgets import BudgetPolicy, BudgetRejected, token_usage
+from farmwise.components import MODEL_ID, AppComponents
+from farmwise.diagnosis_cache import DiagnosisCache
+from farmwise.images import ImageIngest, ImageRejected, image_block, perceptual_hash
+from farmwise.logs import configure_logging, log_event
+from farmwise.rate_limit import BATCH, at_priority
+from farmwise.response_cache import wants_fresh, weather_bucket
+from farmwise.routing import classify
+from farmwise.sessions import with_summary
+from farmwise.sse import sse_event
+
 # Load environment variables
 load_dotenv()
+configure_logging()
+
+# Server processes; each runs its own event loop, caches and Bedrock thread pool
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
 
-# Initialize the Claude model through AWS Bedrock
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name="us-west-2"
+# Blocking Bedrock calls allowed at once per process; the rest wait for a thread
+WEB_MODEL_THREADS = int(os.getenv("WEB_MODEL_THREADS", "16"))
+
+# Seconds in-flight requests get to finish when the server is asked to stop
+WEB_GRACEFUL_SHUTDOWN = int(os.getenv("WEB_GRACEFUL_SHUTDOWN_SECONDS", "30"))
+
+# Bedrock gateway and router, retrieval index, weather, geocoder, caches and session memory, configured
+# from the same environment variables as the backend (see farmwise/components.py)
+components = AppComponents(
+    "web",
+    os.path.dirname(os.path.abspath(__file__)),
+    max_concurrency=WEB_MODEL_THREADS,
+    temperature=0.3,
+    weather_providers="weatherstack,open-meteo,openweathermap",
 )
+bedrock_gateway = components.bedrock_gateway
+model_invoker = components.model_invoker
+model_router = components.model_router
+knowledge_index = components.knowledge_index
+text_budgets = components.budgets
+weather_cache = components.weather_cache
+weather_service = components.weather_service
+weather_prefetcher = components.weather_prefetcher
+geocoder = components.geocoder
+response_cache = components.response_cache
+conversation_memory = components.conversation_memory
+
+ADVISOR_PROMPT = components.advisor_prompt
+BRIEF_ADVISOR_PROMPT = components.brief_advisor_prompt
+WEATHER_DEADLINE = components.weather_deadline
+
+# Output-token ceilings for full and "brief" answers about a crop photo; requests may ask for less
+image_budgets = BudgetPolicy(
+    max_tokens=int(os.getenv("IMAGE_MAX_OUTPUT_TOKENS", "2048")),
+    brief_max_tokens=int(os.getenv("IMAGE_BRIEF_MAX_OUTPUT_TOKENS", "384")),
+)
+
+# Size limits for uploaded crop photos; larger images are downscaled before reaching the model
+image_ingest = ImageIngest(
+    max_bytes=int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024))),
+    max_pixels=int(os.getenv("IMAGE_MAX_PIXELS", "50000000")),
+    max_edge=int(os.getenv("IMAGE_MAX_EDGE", "1568")),
+    max_concurrent=int(os.getenv("IMAGE_DECODE_CONCURRENCY", "4")),
+)
+
+# Reject bodies that could not hold a valid image before buffering them (base64 adds a third)
+MAX_CONTENT_LENGTH = image_ingest.max_bytes * 4 // 3 + 64 * 1024
+
+# Diagnoses keyed by perceptual image hash and question, kept on local disk across restarts and
+# shared by all WEB_WORKERS processes (each rescans the directory every DIAGNOSIS_CACHE_RESCAN_SECONDS)
+diagnosis_cache = DiagnosisCache(
+    os.getenv("DIAGNOSIS_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "diagnoses")),
+    max_bytes=int(os.getenv("DIAGNOSIS_CACHE_MAX_BYTES", str(50 * 1024 * 1024))),
+    max_distance=int(os.getenv("DIAGNOSIS_CACHE_MAX_DISTANCE", "6")),
+    rescan_after=float(os.getenv("DIAGNOSIS_CACHE_RESCAN_SECONDS", "30")),
+)
+
+# Records finished exchanges (and summarizes old ones) off the request path
+memory_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="memory")
+
+metrics.register_cache("diagnosis", diagnosis_cache)
+
+# Chat requests beyond WEB_MAX_IN_FLIGHT wait briefly in a bounded queue, then get 503 instead of piling up
+admission = AdmissionControl(
+    max_in_flight=int(os.getenv("WEB_MAX_IN_FLIGHT", "64")),
+    max_waiting=int(os.getenv("WEB_MAX_WAITING", "64")),
+    queue_timeout=float(os.getenv("WEB_QUEUE_TIMEOUT_SECONDS", "5")),
+    request_timeout=float(os.getenv("WEB_REQUEST_TIMEOUT_SECONDS", "120")),
+    paths=("/chat",),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    components.start()
+    yield
+    # In-flight requests have finished by now; let pending session writes land before exiting
+    memory_executor.shutdown(wait=True)
+    await components.aclose()
+    await http_clients.aclose()
+
+# FastAPI app setup
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(admission.wrap)
+
+async def get_weather_data(location, resolved=None):
+    """
+    Return weather data for the location, served from the cache when possible.
+    The location is geocoded first, so "Lawrence, KS" and "lawrence kansas" share an
+    entry, and is registered for background refresh. The cache key is stored in
+    `resolved["key"]` as soon as it is known.
+    """
+    place = await geocoder.aresolve(location)
+    key = location_key(location, place)
+    if resolved is not None:
+        resolved["key"] = key
+    lat, lon = (place.lat, place.lon) if place else (None, None)
+    # Unresolved places can still be looked up by name with the providers that support it
+    fetch = lambda: weather_service.current(lat=lat, lon=lon, query=location)
+    weather_prefetcher.register(key, fetch)
+    return await weather_cache.aget_or_fetch(key, fetch)
 
-# Flask app setup
-app = Flask(__name__)
+async def wait_for_weather(weather_task, location, resolved):
+    """
+    Return the weather lookup's result, or None if it misses WEATHER_DEADLINE or fails
+    and there are no stale conditions for the location to fall back on.
+    A late lookup keeps running in the background so it still warms the cache.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(weather_task), WEATHER_DEADLINE)
+    except Exception as exc:
+        log_event("weather_unavailable", level=logging.WARNING, error=repr(exc))
+        # The key the lookup caches under; if geocoding has not finished, the best local guess
+        return weather_cache.stale(resolved.get("key") or location_key(location))
 
-# Weatherstack API key from .env
-WEATHERSTACK_API_KEY = os.getenv('WEATHER_API_KEY')
+def location_key(location, place=None):
+    """
+    Cache key for a location: its weather cell when geocoded, else the normalized text.
+    """
+    place = place or geocoder.lookup(location)
+    if place is None:
+        return weather_cache.key_for(location=location)
+    return weather_cache.key_for(lat=place.lat, lon=place.lon)
 
-def get_weather_data(location):
+def start_weather_lookup(location):
     """
-    Fetch weather data from Weatherstack API.
+    Starts the weather lookup; returns its task and the dict its cache key is stored in.
     """
-    url = f"http://api.weatherstack.com/current?access_key={WEATHERSTACK_API_KEY}&query={location}"
-    
-    response = requests.get(url)
-    data = response.json()
-    
-    if response.status_code == 200 and 'current' in data:
-        weather_info = data['current']
-        return {
-            'temperature': weather_info['temperature'],
-            'humidity': weather_info['humidity'],
-            'weather_description': weather_info['weather_descriptions'][0]
-        }
+    resolved = {}
+    weather_task = asyncio.ensure_future(get_weather_data(location, resolved))
+    # Retrieve a late lookup's exception so it is not reported as never retrieved
+    weather_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    return weather_task, resolved
+
+def generate_conversation_with_image(system_prompts, message, image, history=(), budget=None):
+    """
+    Sends a message with an image to the Claude model on AWS Bedrock and returns the ModelResult.
+    The Converse API takes the raw image bytes, so no base64 JSON body has to be built.
+    """
+    image_bytes, image_format = image
+
+    messages = [*history, {"role": "user", "content": [image_block(image_bytes, image_format), {"text": message}]}]
+    inference_config = (budget or image_budgets.resolve()).inference_config()
+
+    return model_router.call(
+        "image",
+        MODEL_ID,
+        lambda model_id: bedrock_gateway.converse(model_id, messages, system=system_prompts, inference_config=inference_config),
+    )
+
+async def read_chat_request(request: Request):
+    """
+    Reads a chat payload sent either as JSON (image as base64) or as multipart form data
+    (image as a file part). Returns (message, location, raw image bytes or None, session id
+    or None, generation options), or None when the message or location is missing.
+    """
+    if int(request.headers.get("content-length") or 0) > MAX_CONTENT_LENGTH:
+        raise ImageRejected(f"Request exceeds {MAX_CONTENT_LENGTH // (1024 * 1024)} MB", 413)
+
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # File parts are spooled to disk by the form parser, so large uploads don't sit in memory
+        data = await request.form()
+        upload = data.get('image')
+        if upload and not isinstance(upload, UploadFile):
+            raise ImageRejected("image must be a file upload")
+        raw_image = await asyncio.to_thread(image_ingest.read_upload, upload.file) if upload else None
     else:
+        data = await read_json(request)
+        image_data = data.get('image') if data else None
+        raw_image = image_ingest.decode_base64(image_payload(image_data)) if image_data else None
+
+    if not data or not isinstance(data.get('message'), str) or not isinstance(data.get('location'), str):
         return None
+    return data['message'], data['location'], raw_image, data.get('session_id'), generation_options(data)
 
-def generate_conversation_text(system_prompts, messages):
+def image_payload(image_data):
     """
-    Sends text-only messages to the Claude model on AWS Bedrock and returns the response.
+    Returns the base64 string of a JSON `{"source": {"data": ...}}` image, rejecting any other shape.
     """
-    model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-    temperature = 0.3
+    source = image_data.get("source") if isinstance(image_data, dict) else None
+    encoded = source.get("data") if isinstance(source, dict) else None
+    if not isinstance(encoded, str):
+        raise ImageRejected('image must be {"source": {"data": "<base64>"}}')
+    return encoded
 
-    inference_config = {"temperature": temperature}
+def generation_options(data):
+    """
+    Reads the optional `brief`, `max_tokens` and `stop` fields of a JSON or form payload
+    into keyword arguments for BudgetPolicy.resolve.
+    """
+    brief = data.get('brief', False)
+    if isinstance(brief, str):
+        brief = brief.strip().lower() in ("1", "true", "yes", "on")
+    max_tokens = data.get('max_tokens')
+    if isinstance(max_tokens, str):
+        # Form fields arrive as text; anything that isn't a number is rejected by resolve()
+        max_tokens = int(max_tokens) if max_tokens.strip().isdigit() else (max_tokens.strip() or None)
+    stop = data.getlist('stop') if hasattr(data, 'getlist') else data.get('stop')
+    return {"brief": bool(brief), "max_tokens": max_tokens, "stop": stop}
 
-    # Send the message
-    response = bedrock_runtime.converse(
-        modelId=model_id,
-        messages=messages,
-        system=system_prompts,
-        inferenceConfig=inference_config,
+async def read_json(request: Request):
+    """
+    Returns the JSON body as a dict, or None if it is not valid JSON. Stops
+    reading as soon as the body exceeds MAX_CONTENT_LENGTH.
+    """
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_CONTENT_LENGTH:
+            raise ImageRejected(f"Request exceeds {MAX_CONTENT_LENGTH // (1024 * 1024)} MB", 413)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+@app.exception_handler(ImageRejected)
+async def image_rejected(request: Request, error: ImageRejected):
+    return JSONResponse({"error": str(error)}, status_code=error.status_code)
+
+@app.exception_handler(BudgetRejected)
+async def budget_rejected(request: Request, error: BudgetRejected):
+    return JSONResponse({"error": str(error)}, status_code=400)
+
+@app.post('/chat')
+async def chat(request: Request):
+    """
+    API endpoint for handling chat requests.
+    Receives user message, location, and optional image, incorporates weather data, and returns model response.
+    """
+    started = time.perf_counter()
+    chat_request = await read_chat_request(request)
+
+    if chat_request is None:
+        return JSONResponse({"error": "Message and location required"}, status_code=400)
+
+    user_message, location, raw_image, session_id, options = chat_request
+    budget = (image_budgets if raw_image else text_budgets).resolve(**options)
+    advisor_prompt = BRIEF_ADVISOR_PROMPT if budget.brief else ADVISOR_PROMPT
+
+    # Start the weather lookup now and prepare the image while it is in flight
+    weather_task, weather_key = start_weather_lookup(location)
+    image = await asyncio.to_thread(prepare_image, raw_image) if raw_image else None
+    del raw_image
+
+    summary, history = conversation_memory.context(session_id) if session_id else ("", [])
+    # Follow-ups depend on the conversation so far, so they never go through the shared caches
+    follow_up = bool(summary or history)
+    use_cache = not (follow_up or wants_fresh(request.headers))
+
+    weather_data = await wait_for_weather(weather_task, location, weather_key)
+    weather_info = describe_weather(location, weather_data)
+    system_prompt = with_summary(
+        advisor_prompt.converse_system(
+            cache=True, location=location, weather_info=weather_info,
+            references=components.references(user_message, budget.brief),
+        ),
+        summary,
     )
+    metrics.PROMPT_BUILD_SECONDS.labels("web").observe(time.perf_counter() - started)
 
-    # Extract the response content
-    text_response = response["output"]["message"]["content"][0]["text"]
-    return text_response
-
-def generate_conversation_with_image(system_prompt, message, image_data):
-    """
-    Sends messages with image to the Claude model on AWS Bedrock and returns the response.
-    """
-    model_id = "anthropic.claude-3-5-sonnet-20240620-v1:0"
-    
-    prompt_config = {
-        "anthropic_version": "bedrock-2023-05-31",
-        "max_tokens": 4096,
-        "messages": [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": image_data["source"]["media_type"],
-                            "data": image_data["source"]["data"],
-                        },
-                    },
-                    {"type": "text", "text": message},
-                ],
-            }
-        ],
-        "system": system_prompt
-    }
+    # Tokens this request spent; cache hits spend none
+    usage = token_usage()
+    if image:
+        # Re-uploads of the same photo with the same question skip the vision model entirely
+        image_hash = await asyncio.to_thread(perceptual_hash, image[0])
+        response = None
+        if use_cache:
+            response = await asyncio.to_thread(diagnosis_cache.get, image_hash, user_message, budget.variant)
+        cache_status = "HIT" if response is not None else "MISS"
+        if response is None:
+            result = await model_invoker.run(
+                generate_conversation_with_image, system_prompt, user_message, image, history, budget
+            )
+            response, usage = result.text, token_usage(result)
+            if not follow_up:
+                await asyncio.to_thread(diagnosis_cache.put, image_hash, user_message, response, budget.variant)
+        remember(session_id, user_message, response, with_image=True)
+        log_chat("/chat", cache_status, started, image_bytes=len(image[0]))
+        return JSONResponse({"response": response, "usage": usage}, headers={"X-Cache": cache_status})
+
+    # Text-only answers can be shared between farmers asking the same thing in similar conditions
+    cache_context = (*response_cache_context(location, weather_data), budget.variant)
+    response = response_cache.get(user_message, cache_context) if use_cache else None
+    cache_status = "HIT" if response is not None else "MISS"
+    if response is None:
+        # Use converse for text-only queries
+        messages = [*history, {"role": "user", "content": [{"text": user_message}]}]
+        result = await model_invoker.run(
+            components.converse, system_prompt, messages, classify(user_message), budget
+        )
+        response, usage = result.text, token_usage(result)
+        if not follow_up:
+            response_cache.put(user_message, cache_context, response)
+
+    remember(session_id, user_message, response)
+    log_chat("/chat", cache_status, started)
+    return JSONResponse({"response": response, "usage": usage}, headers={"X-Cache": cache_status})
+
+@app.post('/chat/stream')
+async def chat_stream(request: Request):
+    """
+    Same contract as /chat, but streams the model response back as Server-Sent Events:
+    one `data: {"text": ...}` message per generated chunk followed by a `done` event
+    carrying the tokens used.
+    """
+    started = time.perf_counter()
+    chat_request = await read_chat_request(request)
+
+    if chat_request is None:
+        return JSONResponse({"error": "Message and location required"}, status_code=400)
+
+    user_message, location, raw_image, session_id, options = chat_request
+    budget = (image_budgets if raw_image else text_budgets).resolve(**options)
+    advisor_prompt = BRIEF_ADVISOR_PROMPT if budget.brief else ADVISOR_PROMPT
+
+    # Start the weather lookup now and prepare the image while it is in flight
+    weather_task, weather_key = start_weather_lookup(location)
+    summary, history = conversation_memory.context(session_id) if session_id else ("", [])
+    follow_up = bool(summary or history)
 
-    body = json.dumps(prompt_config)
-    accept = "application/json"
-    content_type = "application/json"
+    content = [{"text": user_message}]
+    image_hash = None
+    image_bytes = b""
+    if raw_image:
+        image_bytes, image_format = await asyncio.to_thread(prepare_image, raw_image)
+        image_hash = await asyncio.to_thread(perceptual_hash, image_bytes)
+        content.insert(0, image_block(image_bytes, image_format))
+    messages = [*history, {"role": "user", "content": content}]
 
-    response = bedrock_runtime.invoke_model(
-        body=body, modelId=model_id, accept=accept, contentType=content_type
+    weather_data = await wait_for_weather(weather_task, location, weather_key)
+    weather_info = describe_weather(location, weather_data)
+    system_prompt = with_summary(
+        advisor_prompt.converse_system(
+            cache=True, location=location, weather_info=weather_info,
+            references=components.references(user_message, budget.brief),
+        ),
+        summary,
     )
-    response_body = json.loads(response.get("body").read())
+    metrics.PROMPT_BUILD_SECONDS.labels("web").observe(time.perf_counter() - started)
 
-    results = response_body.get("content")[0].get("text")
-    return results
+    cache_context = (*response_cache_context(location, weather_data), budget.variant)
+    cached = None
+    if not (follow_up or wants_fresh(request.headers)):
+        if image_hash is not None:
+            cached = await asyncio.to_thread(diagnosis_cache.get, image_hash, user_message, budget.variant)
+        else:
+            cached = response_cache.get(user_message, cache_context)
+    log_chat("/chat/stream", "HIT" if cached is not None else "MISS", started, image_bytes=len(image_bytes))
 
-@app.route('/chat', methods=['POST'])
-def chat():
+    async def events():
+        if cached is not None:
+            remember(session_id, user_message, cached, with_image=image_hash is not None)
+            yield sse_event({"text": cached})
+            yield sse_event({"usage": token_usage()}, event="done")
+            return
+        chunks = []
+        usage = token_usage()
+        try:
+            async for text in model_invoker.stream(
+                components.converse_stream, system_prompt, messages,
+                classify(user_message, has_image=image_hash is not None), budget, usage,
+            ):
+                chunks.append(text)
+                yield sse_event({"text": text})
+        except Exception as exc:
+            yield sse_event({"error": str(exc)}, event="error")
+            return
+        answer = "".join(chunks)
+        # Follow-up answers depend on the conversation, so they are not shared through the caches
+        if not follow_up:
+            if image_hash is not None:
+                await asyncio.to_thread(diagnosis_cache.put, image_hash, user_message, answer, budget.variant)
+            else:
+                response_cache.put(user_message, cache_context, answer)
+        remember(session_id, user_message, answer, with_image=image_hash is not None)
+        yield sse_event({"usage": usage}, event="done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"X-Cache": "HIT" if cached is not None else "MISS"},
+    )
+
+def prepare_image(raw_image):
     """
-    API endpoint for handling chat requests. 
-    Receives user message, location, and optional image, incorporates weather data, and returns model response.
+    Normalizes an uploaded photo, recording its size before and after.
     """
-    data = request.get_json()
+    metrics.IMAGE_BYTES.labels("upload").observe(len(raw_image))
+    image = image_ingest.normalize(raw_image)
+    metrics.IMAGE_BYTES.labels("model").observe(len(image[0]))
+    return image
 
-    if not data or 'message' not in data or 'location' not in data:
-        return jsonify({"error": "Message and location required"}), 400
+def remember(session_id, user_message, response, with_image=False):
+    """
+    Adds the exchange to the session's history in the background; compaction may call the model.
+    """
+    if session_id:
+        if with_image:
+            user_message += " [crop photo attached]"
+        # Summarizing old turns can wait behind farmers' questions
+        memory_executor.submit(at_priority, BATCH, conversation_memory.record, session_id, user_message, response)
 
-    user_message = data['message']
-    location = data['location']
-    image_data = data.get('image')
+def log_chat(endpoint, cache_status, started, image_bytes=0):
+    log_event(
+        "chat",
+        endpoint=endpoint,
+        cache=cache_status,
+        image_bytes=image_bytes,
+        # For streams this is the time until the response starts
+        total_ms=round((time.perf_counter() - started) * 1000),
+    )
 
-    # Fetch weather data based on the user's location
-    weather_data = get_weather_data(location)
+def response_cache_context(location, weather_data):
+    """
+    Coarse context a text answer is cached under: the location's weather cell and weather bucket.
+    """
+    if not weather_data:
+        return (location_key(location), None)
+    return (
+        location_key(location),
+        weather_bucket(weather_data.temperature_c, weather_data.humidity),
+    )
 
+def describe_weather(location, weather_data):
+    """
+    Turns a weather lookup into the sentence appended to the system prompt.
+    """
     if weather_data:
-        weather_info = f"The current weather in {location} is {weather_data['weather_description']}, " \
-                       f"with a temperature of {weather_data['temperature']}°C and humidity of {weather_data['humidity']}%."
-    else:
-        weather_info = "Weather data is unavailable for the given location."
-
-    # System prompt that includes weather data
-    system_prompt = f"""
-    You are an expert agricultural advisor specializing in crop management, soil health, and disease prevention. The farmer you're assisting is located in {location}. {weather_info} Use this weather data to provide contextually relevant advice.
-
-    Always follow this process when responding to queries:
-    1. Analyze the query and relevant data (weather, soil, images if provided).
-    2. Break down your reasoning step-by-step.
-    3. Provide clear, actionable advice using simple language.
-    4. Include relevant examples or analogies to clarify your suggestions.
-    5. Summarize your key recommendations.
-
-    Here are three examples of how to respond to different types of queries:
-
-    Example 1 - Crop Selection:
-    Query: "What crops should I plant next month given the current weather?"
-    Response:
-    1. Analysis:
-       - Current month: [Insert month]
-       - Weather: {weather_info}
-       - Location: {location}
-    2. Reasoning:
-       - The temperature and humidity levels suggest [warm/cool/wet/dry] conditions.
-       - These conditions are generally favorable for [crop types].
-       - However, we need to consider potential weather changes in the coming months.
-    3. Recommendations:
-       a) Consider planting [Crop 1], which thrives in these conditions and has a growth cycle that aligns with the upcoming months.
-       b) [Crop 2] is another good option, as it's resistant to [relevant weather condition] and suits your location.
-       c) Avoid [Crop 3] for now, as it's sensitive to [current or upcoming weather condition].
-    4. Example:
-       If you plant [Crop 1], you can expect to [specific benefit]. For instance, a farmer in a similar climate saw [specific result] last year.
-    5. Summary:
-       Focus on [Crop 1] and [Crop 2] for the best results given your current conditions. Prepare the soil by [specific preparation method] to ensure optimal growth.
-
-    Example 2 - Disease Prevention:
-    Query: "My tomato plants have yellow leaves. What should I do?"
-    Response:
-    1. Analysis:
-       - Crop: Tomatoes
-       - Symptom: Yellow leaves
-       - Weather: {weather_info}
-    2. Reasoning:
-       - Yellow leaves in tomatoes can be caused by various factors: nutrient deficiencies, overwatering, or diseases.
-       - Given the current [wet/dry] conditions, [likely cause] is a primary suspect.
-       - We need to rule out other possibilities before treatment.
-    3. Recommendations:
-       a) Inspect the plants closely, checking for any spots, wilting, or insects.
-       b) Check soil moisture levels - stick your finger 2 inches into the soil. It should be moist but not waterlogged.
-       c) If the soil is too wet, improve drainage by [specific method].
-       d) If nutrient deficiency is suspected, apply a balanced fertilizer, focusing on [specific nutrient].
-       e) For disease prevention, apply a copper-based fungicide as a precautionary measure.
-    4. Example:
-       Last season, a farmer in [nearby location] faced a similar issue. By [specific action], they were able to save 90% of their crop.
-    5. Summary:
-       Start with improving drainage and applying balanced fertilizer. Monitor closely for a week, and if symptoms persist, apply the fungicide treatment.
-
-    Example 3 - Soil Health:
-    Query: "How can I improve my soil quality for better yield?"
-    Response:
-    1. Analysis:
-       - Concern: Soil quality
-       - Goal: Improved yield
-       - Current conditions: {weather_info}
-    2. Reasoning:
-       - Soil health is fundamental to crop yield and resilience.
-       - Key factors: organic matter content, pH levels, nutrient balance, and soil structure.
-       - Given your location and weather, focus on [specific soil characteristic].
-    3. Recommendations:
-       a) Conduct a soil test to determine current nutrient levels and pH.
-       b) Based on typical soil in {location}, consider adding [specific amendment] to balance [nutrient/pH].
-       c) Implement crop rotation to prevent nutrient depletion. Rotate [crop 1] with [crop 2] for best results.
-       d) Use cover crops like [specific cover crop] during off-seasons to add organic matter and prevent erosion.
-       e) Apply compost or well-rotted manure to increase organic matter content.
-    4. Example:
-       A study in [relevant agricultural region] showed that farmers who implemented these practices saw a 30% increase in yield over three years.
-    5. Summary:
-       Start with a soil test, then focus on adding organic matter through compost and cover crops. Implement crop rotation, and adjust pH if necessary. These steps will significantly improve your soil health and crop yield over time.
-
-    If an image is provided, analyze it for any visible plant diseases or issues, and incorporate your findings into your response following the structure above.
-
-    Remember, only provide advice on crop management, soil health, and disease prevention. Avoid discussing other topics.
-    """
-
-    if image_data:
-        # Use invoke_model for queries with images
-        response = generate_conversation_with_image(system_prompt, user_message, image_data)
-    else:
-        # Use converse for text-only queries
-        messages = [{"role": "user", "content": [{"text": user_message}]}]
-        response = generate_conversation_text([{"text": system_prompt}], messages)
+        readings = f"a temperature of {weather_data.temperature_c:g}°C and humidity of {weather_data.humidity:g}%"
+        if weather_data.description:
+            sentence = f"The current weather in {location} is {weather_data.description.lower()}, with {readings}."
+        else:
+            sentence = f"The current weather in {location} has {readings}."
+        return sentence + weather_data.age_note(weather_cache.ttl)
+    return "Weather data is unavailable for the given location."
 
-    return jsonify({"response": response})
+@app.get('/stats')
+async def stats():
+    return {
+        "model": model_invoker.stats(),
+        "models": bedrock_gateway.stats(),
+        "routing": model_router.stats(),
+        "admission": admission.stats(),
+        "weather": weather_service.stats(),
+        "weather_cache": weather_cache.stats(),
+        "weather_prefetch": weather_prefetcher.stats(),
+        "geocoder": geocoder.stats(),
+        "retrieval": knowledge_index.stats(),
+        "response_cache": response_cache.stats(),
+        "diagnosis_cache": diagnosis_cache.stats(),
+        "sessions": conversation_memory.stats(),
+    }
+
+@app.get('/metrics')
+async def prometheus_metrics():
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=3000)
\ No newline at end of file
+    import uvicorn
+
+    if WEB_WORKERS > 1:
+        # Each worker is its own process; /metrics aggregates them through a shared directory
+        metrics.prepare_multiprocess()
+
+    # Workers are separate processes, so the app is passed by import path
+    uvicorn.run(
+        "app:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=3000,
+        workers=WEB_WORKERS,
+        timeout_graceful_shutdown=WEB_GRACEFUL_SHUTDOWN,
+    )
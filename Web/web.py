@@ -1,9 +1,12 @@
 import streamlit as st
 import requests
 import json
-import base64
-from PIL import Image
+from PIL import Image, ImageOps
 import io
+import uuid
+
+# Longest image edge the vision model makes use of; anything larger only costs upload time and tokens
+MAX_IMAGE_EDGE = 1568
 
 # Custom CSS for better styling and earthy look
 st.markdown("""
@@ -86,25 +89,54 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Function to convert PIL image to base64 string
-def pil_to_base64(image, format="png"):
+# Function to shrink an uploaded photo before sending it to the API
+def prepare_image(uploaded_file, max_edge=MAX_IMAGE_EDGE, format="jpeg", quality=85):
     """
-    Converts a PIL image to a base64 encoded string.
+    Downscales and re-encodes an uploaded crop photo for upload.
 
-    This function takes an image in PIL format and converts it into a base64 string representation, which can be used for embedding images in web applications or APIs. The output format can be specified, with PNG as the default.
+    The image is rotated upright from its EXIF orientation, resized so its longest edge is at most `max_edge` pixels, and saved as a quality-tuned JPEG (or WebP) without EXIF metadata.
 
     Args:
-        image (PIL.Image): The image to be converted.
-        format (str): The format to save the image in (default is "png").
+        uploaded_file (UploadedFile): The file returned by `st.file_uploader`.
+        max_edge (int): The maximum width or height in pixels (default is MAX_IMAGE_EDGE).
+        format (str): "jpeg" or "webp" (default is "jpeg").
+        quality (int): The encoder quality from 1 to 100 (default is 85).
 
     Returns:
-        str: The base64 encoded string of the image.
+        tuple: The encoded image bytes, their media type, and the original size in bytes.
 
     """
 
+    original_size = len(uploaded_file.getvalue())
+    image = ImageOps.exif_transpose(Image.open(uploaded_file))
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
     with io.BytesIO() as buffer:
-        image.save(buffer, format)
-        return base64.b64encode(buffer.getvalue()).decode()
+        image.save(buffer, format, quality=quality, optimize=True)
+        return buffer.getvalue(), f"image/{format}", original_size
+
+# Function to parse the streamed answer from the API
+def iter_sse_events(response):
+    """
+    Parses a streaming Server-Sent Events response.
+
+    Args:
+        response (requests.Response): A response opened with `stream=True`.
+
+    Yields:
+        tuple: The event name ("message" when unnamed) and its decoded JSON payload.
+    """
+
+    event = "message"
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            event = "message"
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            yield event, json.loads(line[len("data:"):].strip())
 
 # Side pane for future features, useful tips, or links
 with st.sidebar:
@@ -121,6 +153,10 @@ with st.sidebar:
     st.write("- Crop Diseases")
     st.write("- Farming Recommendations")
 
+# One conversation per browser session, so follow-up questions keep their context
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+
 # Title of the app
 st.markdown("<h1 style='color:#4e342e;'>FARMWISE: THE SOLUTION TO YOUR FARMING QUESTIONS!</h1>", unsafe_allow_html=True)
 
@@ -135,6 +171,9 @@ user_location = st.text_input("Enter your location (e.g., 'Lawrence, Kansas'):")
 # User image input
 uploaded_image = st.file_uploader("Upload an image of your crop (optional for disease detection):", type=["png", "jpg", "jpeg"])
 
+# Short answers come back much faster on slow connections
+brief_answer = st.checkbox("Short answer (faster on slow connections)")
+
 # Button to get response
 if st.button("Get Answer"):
     if user_query and user_location:
@@ -142,30 +181,37 @@ if st.button("Get Answer"):
         api_url = "http://localhost:3000/chat"
         payload = {
             "message": user_query,
-            "location": user_location
+            "location": user_location,
+            "session_id": st.session_state.session_id,
+            "brief": brief_answer,
         }
         
-        # If an image is uploaded, convert it to base64 and add it to the payload
+        # If an image is uploaded, shrink it and send it as a multipart file part (no base64 overhead)
+        files = None
         if uploaded_image is not None:
-            image = Image.open(uploaded_image)
-            image_base64 = pil_to_base64(image)
-            payload["image"] = {
-                "type": "image",
-                "source": {
-                    "type": "base64",
-                    "media_type": "image/jpeg",  # Adjust media type based on image type
-                    "data": image_base64
-                }
-            }
+            image_bytes, media_type, original_size = prepare_image(uploaded_image)
+            st.caption(f"Image compressed from {original_size / 1024:.0f} KB to {len(image_bytes) / 1024:.0f} KB for upload.")
+            files = {"image": ("crop." + media_type.split("/")[-1], image_bytes, media_type)}
         
         try:
-            # Make a POST request to the Flask API
-            response = requests.post(api_url, json=payload)
+            # Stream the answer from the FastAPI chat API so tokens render as they arrive
+            if files:
+                response = requests.post(api_url + "/stream", data=payload, files=files, stream=True)
+            else:
+                response = requests.post(api_url + "/stream", json=payload, stream=True)
             
             if response.status_code == 200:
-                data = response.json()
                 st.markdown(f"<div class='user-message'>{user_query}</div>", unsafe_allow_html=True)
-                st.markdown(f"<div class='assistant-message'>{data['response']}</div>", unsafe_allow_html=True)
+                answer_placeholder = st.empty()
+                answer = ""
+                for event, data in iter_sse_events(response):
+                    if event == "error":
+                        st.error(f"Error: {data['error']}")
+                        break
+                    if event == "done":
+                        break
+                    answer += data["text"]
+                    answer_placeholder.markdown(f"<div class='assistant-message'>{answer}</div>", unsafe_allow_html=True)
             else:
                 st.error(f"Error: {response.status_code}")
         except Exception as e:
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import base64
+import importlib.util
+import itertools
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+
+from farmwise import http_clients
+from bench.stubs import REPLY, StubBedrockClient, StubWeatherTransport, parse_latency
+
+# Endpoint each target drives, and which app serves it
+TARGETS = {
+    "backend": ("Backend/main.py", "/"),
+    "backend-stream": ("Backend/main.py", "/stream"),
+    "web": ("Web/app.py", "/chat"),
+    "web-stream": ("Web/app.py", "/chat/stream"),
+}
+
+PROMPTS = [
+    "When should I plant corn?",
+    "How often should I water tomatoes?",
+    "My soybean leaves have yellow spots, what disease is it and how do I treat it?",
+    "What cover crop is best after wheat?",
+    "Why are my pepper plants wilting even though the soil is moist?",
+    "How much nitrogen does sweet corn need?",
+]
+
+LOCATIONS = [
+    ("38.9241", "-94.7315", "Lenexa, Kansas"),
+    ("41.5868", "-93.6250", "Des Moines, Iowa"),
+    ("39.0997", "-94.5786", "Kansas City, Missouri"),
+    ("40.8136", "-96.7026", "Lincoln, Nebraska"),
+]
+
+
+def load_app(target):
+    """
+    Imports the target's app module by path, the way its own server would.
+    """
+    path, _ = TARGETS[target]
+    spec = importlib.util.spec_from_file_location(f"bench_{target.split('-')[0]}_app", os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def payloads(target, distinct, image, options=None):
+    """
+    Yields request bodies forever, cycling through `distinct` prompt/location pairs.
+    `options` (e.g. brief, max_tokens) are added to every body.
+    """
+    bodies = []
+    for index in range(distinct):
+        prompt = PROMPTS[index % len(PROMPTS)]
+        if index >= len(PROMPTS):
+            prompt = f"{prompt} This is for field {index // len(PROMPTS)}."
+        lat, lon, location = LOCATIONS[index % len(LOCATIONS)]
+        if target.startswith("backend"):
+            bodies.append({"prompt": prompt, "lat": lat, "lon": lon})
+        else:
+            body = {"message": prompt, "location": location}
+            if image:
+                body["image"] = {"source": {"data": image}}
+            bodies.append(body)
+    for body in bodies:
+        body.update(options or {})
+    return itertools.cycle(bodies)
+
+
+def drive_asgi(app, path, bodies, total, concurrency, headers):
+    latencies, errors = [], 0
+
+    async def main():
+        nonlocal errors
+        remaining = iter(range(total))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def worker():
+                nonlocal errors
+                for _ in remaining:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.post(path, json=next(bodies), headers=headers)
+                        failed = response.status_code >= 400 or b"event: error" in response.content
+                    except Exception:
+                        failed = True
+                    latencies.append(time.perf_counter() - started)
+                    errors += failed
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    asyncio.run(main())
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load-test a FARMWISE backend in-process against local Bedrock and weather stubs. "
+        "Latencies are distributions in ms: fixed:MS, uniform:LOW,HIGH, normal:MEAN,SD, "
+        "lognormal:MEDIAN,SIGMA or exp:MEAN."
+    )
+    parser.add_argument("target", choices=sorted(TARGETS))
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("--distinct", type=int, default=None,
+                        help="distinct prompt/location pairs to cycle through (default: one per request)")
+    parser.add_argument("--no-cache", action="store_true", help="send Cache-Control: no-cache")
+    parser.add_argument("--model-latency", default="lognormal:1500,0.4")
+    parser.add_argument("--first-token", default="lognormal:400,0.3")
+    parser.add_argument("--tokens-per-second", type=float, default=60)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--quota", type=float, default=0, help="requests per minute per model before throttling")
+    parser.add_argument("--weather-latency", default="lognormal:150,0.5")
+    parser.add_argument("--weather-host-latency", action="append", default=[], metavar="HOST=LATENCY",
+                        help="latency for one weather host, e.g. api.openweathermap.org=lognormal:300,1.2")
+    parser.add_argument("--weather-down", action="append", default=[], metavar="HOST",
+                        help="weather host that answers 503 (repeatable)")
+    parser.add_argument("--image", help="crop photo to attach (web targets only)")
+    parser.add_argument("--brief", action="store_true", help="ask for brief answers")
+    parser.add_argument("--max-tokens", type=int, default=None, help="output-token cap sent with each request")
+    parser.add_argument("--reply-words", type=int, default=None,
+                        help="length of the stub's full reply (default: the canned 60-word answer)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print one JSON line instead of a table")
+    args = parser.parse_args()
+
+    # Nothing below may reach AWS or a weather API, and disk caches must start empty
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-2")
+    os.environ.setdefault("OPEN_WEATHER_API", "bench")
+    os.environ.setdefault("WEATHER_API_KEY", "bench")
+    os.environ["DIAGNOSIS_CACHE_DIR"] = tempfile.mkdtemp(prefix="farmwise-bench-")
+    os.environ.setdefault("LOG_SAMPLE_RATE", "0")
+
+    weather = StubWeatherTransport(
+        parse_latency(args.weather_latency),
+        seed=args.seed,
+        host_latency={
+            host: parse_latency(spec) for host, spec in (item.split("=", 1) for item in args.weather_host_latency)
+        },
+        down=args.weather_down,
+    )
+    http_clients.use_transport(weather)
+    module = load_app(args.target)
+    bedrock = StubBedrockClient(
+        parse_latency(args.model_latency),
+        parse_latency(args.first_token),
+        tokens_per_second=args.tokens_per_second,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+        quota_per_minute=args.quota,
+        **({"reply": " ".join(itertools.islice(itertools.cycle(REPLY.split(" ")), args.reply_words))}
+           if args.reply_words else {}),
+    )
+    module.bedrock_gateway.client = bedrock
+
+    image = None
+    if args.image:
+        with open(args.image, "rb") as image_file:
+            image = base64.b64encode(image_file.read()).decode("ascii")
+    options = {"brief": True} if args.brief else {}
+    if args.max_tokens:
+        options["max_tokens"] = args.max_tokens
+    bodies = payloads(args.target, args.distinct or args.requests, image, options)
+    headers = {"Cache-Control": "no-cache"} if args.no_cache else {}
+
+    _, path = TARGETS[args.target]
+    started = time.perf_counter()
+    latencies, errors = drive_asgi(module.app, path, bodies, args.requests, args.concurrency, headers)
+    elapsed = time.perf_counter() - started
+
+    report = {
+        "target": args.target,
+        "requests": len(latencies),
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "bedrock_calls": bedrock.calls,
+        "throttled": bedrock.throttled,
+        "output_tokens": bedrock.output_tokens,
+        "weather_calls": weather.calls,
+        "weather_hedges": module.weather_service.hedges,
+        "weather_failovers": module.weather_service.failovers,
+    }
+    if args.json:
+        print(json.dumps(report))
+    else:
+        for key, value in report.items():
+            print(f"{key:>16}: {value}")
+
+
+if __name__ == "__main__":
+    main()
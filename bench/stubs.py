@@ -0,0 +1,233 @@
+import asyncio
+import io
+import json
+import random
+import threading
+import time
+import zlib
+
+import httpx
+from botocore.exceptions import ClientError
+
+REPLY = (
+    "Based on the current weather and your location, water early in the morning and check the lower "
+    "leaves for yellowing or spots. If you see lesions spreading, remove the affected leaves, improve "
+    "airflow between rows and consider a copper-based fungicide. Test your soil pH before the next "
+    "planting and keep notes so we can compare over the season."
+)
+
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution in milliseconds and returns a sampler that
+    takes a `random.Random` and returns seconds.
+
+    Accepted forms: "fixed:MS", "uniform:LOW,HIGH", "normal:MEAN,SD",
+    "lognormal:MEDIAN,SIGMA" and "exp:MEAN".
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    samplers = {
+        "fixed": (1, lambda rng, ms: ms),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "normal": (2, lambda rng, mean, sd: rng.gauss(mean, sd)),
+        "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0, sigma)),
+        "exp": (1, lambda rng, mean: rng.expovariate(1 / mean) if mean else 0),
+    }
+    if kind not in samplers or len(values) != samplers[kind][0]:
+        raise ValueError(f"Bad latency spec {spec!r}; expected e.g. fixed:200 or lognormal:800,0.5")
+    sample = samplers[kind][1]
+    return lambda rng: max(0.0, sample(rng, *values)) / 1000
+
+
+class StubBedrockClient:
+    """
+    Local stand-in for the bedrock-runtime client.
+
+    Implements `converse`, `converse_stream` and `invoke_model` with canned
+    replies and sampled latencies. `throttle_rate` of calls fail with a
+    ThrottlingException, which exercises the router's failover, and so does
+    every call beyond `quota_per_minute` per model (a one-second token bucket).
+    Replies are cut off at `maxTokens`, counting one token per word.
+    """
+
+    def __init__(self, latency, first_token, tokens_per_second=60, throttle_rate=0.0, seed=None, reply=REPLY,
+                 quota_per_minute=0):
+        self.latency = latency
+        self.first_token = first_token
+        self.tokens_per_second = tokens_per_second
+        self.throttle_rate = throttle_rate
+        self.quota_per_minute = quota_per_minute
+        self.reply = reply
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._quota = {}
+        self.calls = 0
+        self.throttled = 0
+        self.output_tokens = 0
+
+    def _over_quota(self, model_id):
+        if not self.quota_per_minute:
+            return False
+        now = time.monotonic()
+        capacity = max(1.0, self.quota_per_minute / 60)
+        tokens, refilled_at = self._quota.get(model_id, (capacity, now))
+        tokens = min(capacity, tokens + (now - refilled_at) * self.quota_per_minute / 60)
+        if tokens < 1:
+            self._quota[model_id] = (tokens, now)
+            return True
+        self._quota[model_id] = (tokens - 1, now)
+        return False
+
+    def _sample(self, distribution, model_id):
+        with self._lock:
+            self.calls += 1
+            throttled = self._over_quota(model_id) or self._rng.random() < self.throttle_rate
+            self.throttled += throttled
+            return distribution(self._rng), throttled
+
+    @staticmethod
+    def _throttle(operation):
+        raise ClientError({"Error": {"Code": "ThrottlingException", "Message": "Stub throttle"}}, operation)
+
+    def _reply(self, max_tokens=None):
+        words = self.reply.split(" ")
+        stop_reason = "end_turn"
+        if max_tokens and len(words) > max_tokens:
+            words, stop_reason = words[:max_tokens], "max_tokens"
+        with self._lock:
+            self.output_tokens += len(words)
+        return words, stop_reason
+
+    @staticmethod
+    def _usage(messages, system, words):
+        prompt = json.dumps([messages, system or []], default=lambda value: "<bytes>")
+        input_tokens = len(prompt) // 4
+        return {"inputTokens": input_tokens, "outputTokens": len(words), "totalTokens": input_tokens + len(words)}
+
+    def converse(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        delay, throttled = self._sample(self.latency, modelId)
+        if throttled:
+            self._throttle("Converse")
+        words, stop_reason = self._reply((inferenceConfig or {}).get("maxTokens"))
+        # The sampled latency is for a full reply; a capped one takes proportionally less
+        time.sleep(delay * len(words) / len(self.reply.split(" ")))
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": " ".join(words)}]}},
+            "stopReason": stop_reason,
+            "usage": self._usage(messages, system, words),
+            "metrics": {"latencyMs": int(delay * 1000)},
+        }
+
+    def converse_stream(self, modelId, messages, system=None, inferenceConfig=None, **kwargs):
+        delay, throttled = self._sample(self.first_token, modelId)
+        if throttled:
+            self._throttle("ConverseStream")
+        words, stop_reason = self._reply((inferenceConfig or {}).get("maxTokens"))
+        return {"stream": self._events(delay, words, stop_reason, self._usage(messages, system, words))}
+
+    def _events(self, first_token_delay, words, stop_reason, usage):
+        time.sleep(first_token_delay)
+        yield {"messageStart": {"role": "assistant"}}
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(1 / self.tokens_per_second)
+            yield {"contentBlockDelta": {"contentBlockIndex": 0, "delta": {"text": (" " if index else "") + word}}}
+        yield {"contentBlockStop": {"contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": stop_reason}}
+        yield {"metadata": {"usage": usage, "metrics": {"latencyMs": int(first_token_delay * 1000)}}}
+
+    def invoke_model(self, modelId, body, **kwargs):
+        request = json.loads(body)
+        delay, throttled = self._sample(self.latency, modelId)
+        if throttled:
+            self._throttle("InvokeModel")
+        words, stop_reason = self._reply(request.get("max_tokens"))
+        time.sleep(delay * len(words) / len(self.reply.split(" ")))
+        usage = self._usage(request.get("messages"), request.get("system"), words)
+        payload = {
+            "content": [{"type": "text", "text": " ".join(words)}],
+            "stop_reason": stop_reason,
+            "usage": {"input_tokens": usage["inputTokens"], "output_tokens": usage["outputTokens"]},
+        }
+        return {"body": io.BytesIO(json.dumps(payload).encode("utf-8")), "contentType": "application/json"}
+
+
+def _conditions(key):
+    # Stable per location so cache keys and weather buckets behave like the real thing
+    seed = zlib.crc32(key.encode("utf-8"))
+    return 50 + seed % 40, 30 + (seed >> 8) % 60, 2 + (seed >> 16) % 20
+
+
+class StubWeatherTransport(httpx.BaseTransport, httpx.AsyncBaseTransport):
+    """
+    httpx transport that answers OpenWeather, Weatherstack, Open-Meteo and geocoding
+    requests locally after a sampled delay. Works for both the sync and the async shared client.
+
+    `host_latency` overrides the delay per host, and hosts in `down` answer 503,
+    which exercises the weather service's hedging, failover and circuit breakers.
+    """
+
+    def __init__(self, latency, seed=None, host_latency=None, down=()):
+        self.latency = latency
+        self.host_latency = dict(host_latency or {})
+        self.down = set(down)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _delay(self, host):
+        with self._lock:
+            self.calls += 1
+            return self.host_latency.get(host, self.latency)(self._rng)
+
+    def _respond(self, request):
+        params = request.url.params
+        if request.url.host in self.down:
+            return httpx.Response(503, json={"message": "stub outage"})
+        if request.url.host == "api.weatherstack.com":
+            temperature, humidity, wind_speed = _conditions(params.get("query", ""))
+            # Weatherstack reports Celsius and km/h by default
+            body = {"current": {
+                "temperature": round((temperature - 32) * 5 / 9),
+                "humidity": humidity,
+                "wind_speed": round(wind_speed * 1.609),
+                "weather_descriptions": ["Partly cloudy"],
+            }}
+        elif request.url.host == "api.openweathermap.org":
+            temperature, humidity, wind_speed = _conditions(f"{params.get('lat')},{params.get('lon')}")
+            if params.get("units") == "metric":
+                temperature, wind_speed = round((temperature - 32) * 5 / 9, 1), round(wind_speed / 2.237, 1)
+            body = {
+                "main": {"temp": temperature, "humidity": humidity},
+                "wind": {"speed": wind_speed},
+                "weather": [{"description": "scattered clouds"}],
+            }
+        elif request.url.host == "api.open-meteo.com":
+            temperature, humidity, wind_speed = _conditions(f"{params.get('latitude')},{params.get('longitude')}")
+            body = {"current": {
+                "temperature_2m": round((temperature - 32) * 5 / 9, 1),
+                "relative_humidity_2m": humidity,
+                "wind_speed_10m": round(wind_speed * 1.609, 1),
+                "weather_code": 2,
+            }}
+        elif request.url.host == "geocoding-api.open-meteo.com":
+            # Any name resolves to a stable point in the Midwest, reported as unstated-state US
+            seed = zlib.crc32(params.get("name", "").encode("utf-8"))
+            body = {"results": [{
+                "name": params.get("name", "").title(),
+                "latitude": 36 + seed % 800 / 100,
+                "longitude": -100 + (seed >> 10) % 1400 / 100,
+                "country_code": "US",
+            }]}
+        else:
+            return httpx.Response(404, json={"message": "not stubbed"})
+        return httpx.Response(200, json=body)
+
+    def handle_request(self, request):
+        time.sleep(self._delay(request.url.host))
+        return self._respond(request)
+
+    async def handle_async_request(self, request):
+        await asyncio.sleep(self._delay(request.url.host))
+        return self._respond(request)
@@ -0,0 +1,96 @@
+import asyncio
+import json
+
+from farmwise import metrics
+
+
+async def _send_json(send, status, body, headers=()):
+    payload = json.dumps(body).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+class AdmissionControl:
+    """
+    Bounds how much work an ASGI app takes on at once.
+
+    Up to `max_in_flight` requests run concurrently and up to `max_waiting`
+    more may wait `queue_timeout` seconds for a slot; anything beyond that is
+    answered 503 immediately instead of queueing forever. A request still
+    running after `request_timeout` seconds is cancelled (504 if nothing was
+    sent yet). Only paths starting with one of `paths` are limited.
+
+    Install with `app.add_middleware(admission.wrap)`.
+    """
+
+    def __init__(self, max_in_flight=32, max_waiting=64, queue_timeout=5, request_timeout=120, paths=("/",)):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.paths = tuple(paths)
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def wrap(self, app):
+        async def admitted(scope, receive, send):
+            if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+                return await app(scope, receive, send)
+            if not await self._acquire():
+                self.rejected += 1
+                metrics.REQUESTS_REJECTED.labels("busy").inc()
+                return await _send_json(
+                    send, 503, {"error": "Server is busy, please retry shortly"}, [(b"retry-after", b"1")]
+                )
+
+            response_started = False
+
+            async def tracked_send(message):
+                nonlocal response_started
+                response_started = response_started or message["type"] == "http.response.start"
+                await send(message)
+
+            try:
+                await asyncio.wait_for(app(scope, receive, tracked_send), self.request_timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                metrics.REQUESTS_REJECTED.labels("timeout").inc()
+                if not response_started:
+                    await _send_json(send, 504, {"error": "Request timed out"})
+            finally:
+                self.in_flight -= 1
+                self._semaphore.release()
+
+        return admitted
+
+    async def _acquire(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                return False
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        return True
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
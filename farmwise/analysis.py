@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import sys
+
+from farmwise.bedrock import ModelInvoker
+from farmwise.prompts import CACHE_MIN_TOKENS, supports_prompt_cache
+from farmwise.rate_limit import BATCH, RateLimiter, request_priority
+from farmwise.sessions import estimate_tokens
+
+# One model for every task on a document, so they all read the same cached document prefix
+DEFAULT_ANALYSIS_MODEL = "anthropic.claude-3-5-haiku-20241022-v1:0"
+
+ANALYST_INSTRUCTIONS = (
+    "You are an assistant that analyzes agricultural extension documents for farmers. "
+    "Base every answer only on the document below."
+)
+
+# Per-document tasks and the instruction each one sends after the shared document prefix
+TASK_PROMPTS = {
+    "summary": "Summarize the document in 50 words or less.",
+    "sentiment": "Return only a JSON object of sentiment analysis of the document.",
+}
+
+QUESTION_PROMPT = "Answer the question. If the answer is not in the document, say you do not know.\n\nQuestion: {question}"
+
+
+def read_documents(paths):
+    """
+    Yields documents as `{"id", "text", "questions"}` dicts, one at a time.
+
+    `.jsonl` files (and "-" for stdin) hold one JSON object per line with a
+    `text` and optional `id` and `questions`; any other file is a single
+    plain-text document whose id is its path.
+    """
+    for path in paths:
+        if path == "-" or path.endswith(".jsonl"):
+            source = sys.stdin if path == "-" else open(path, encoding="utf-8")
+            try:
+                for number, line in enumerate(source, 1):
+                    if line.strip():
+                        document = json.loads(line)
+                        document.setdefault("id", f"{path}:{number}")
+                        yield document
+            finally:
+                if source is not sys.stdin:
+                    source.close()
+        else:
+            with open(path, encoding="utf-8") as f:
+                yield {"id": os.path.basename(path), "text": f.read()}
+
+
+class DocumentPipeline:
+    """
+    Summarizes, scores and answers questions about a stream of documents.
+
+    Every task on a document runs concurrently, and up to `max_documents`
+    documents are in progress at once; model calls share `max_concurrency`
+    worker threads and a `per_minute` rate limit. The document is sent as a
+    system prefix behind a prompt-cache checkpoint, so for long documents the
+    first task writes the cache and the rest read it instead of paying for
+    the whole document again.
+    """
+
+    def __init__(self, gateway, model_id=DEFAULT_ANALYSIS_MODEL, questions=(), tasks=tuple(TASK_PROMPTS),
+                 per_minute=60, max_concurrency=8, max_documents=4, inference_config=None):
+        self.gateway = gateway
+        self.model_id = model_id
+        self.questions = list(questions)
+        self.tasks = list(tasks)
+        self.max_documents = max_documents
+        self.inference_config = inference_config or {"temperature": 0.5}
+        self.rate_limiter = RateLimiter(per_minute)
+        self.invoker = ModelInvoker(max_concurrency=max_concurrency)
+        self.documents = 0
+        self.failed_calls = 0
+
+    def system_for(self, text):
+        """
+        Returns the system blocks for a document, with a cache checkpoint when it is long enough to pay off.
+        """
+        blocks = [{"text": f"{ANALYST_INSTRUCTIONS}\n\n<document>\n{text}\n</document>"}]
+        if estimate_tokens(text) >= CACHE_MIN_TOKENS and supports_prompt_cache(self.model_id):
+            blocks.append({"cachePoint": {"type": "default"}})
+        return blocks
+
+    async def _ask(self, system, prompt):
+        await self.rate_limiter.acquire()
+        messages = [{"role": "user", "content": [{"text": prompt}]}]
+        return await self.invoker.run(
+            self.gateway.converse, self.model_id, messages, system=system, inference_config=self.inference_config
+        )
+
+    async def analyze(self, document):
+        """
+        Runs every task for one document and returns its result record.
+        """
+        system = self.system_for(document["text"])
+        questions = document.get("questions") or self.questions
+        prompts = [TASK_PROMPTS[task] for task in self.tasks]
+        prompts += [QUESTION_PROMPT.format(question=question) for question in questions]
+
+        calls = [self._ask(system, prompt) for prompt in prompts]
+        if len(system) > 1 and calls:
+            # Concurrent first calls would all miss; let one write the cache before the rest read it
+            first = await asyncio.gather(calls[0], return_exceptions=True)
+            results = first + await asyncio.gather(*calls[1:], return_exceptions=True)
+        else:
+            results = await asyncio.gather(*calls, return_exceptions=True)
+
+        record = {"id": document.get("id")}
+        usage = {"input_tokens": 0, "output_tokens": 0, "cache_read_tokens": 0, "cache_write_tokens": 0}
+        errors = {}
+        answers = []
+        for index, result in enumerate(results):
+            name = self.tasks[index] if index < len(self.tasks) else questions[index - len(self.tasks)]
+            if isinstance(result, Exception):
+                self.failed_calls += 1
+                errors[name] = str(result)
+                text = None
+            else:
+                text = result.text
+                for kind in usage:
+                    usage[kind] += getattr(result, kind)
+            if index < len(self.tasks):
+                record[name] = text
+            else:
+                answers.append({"question": name, "answer": text})
+        if questions:
+            record["answers"] = answers
+        if errors:
+            record["errors"] = errors
+        record["usage"] = usage
+        self.documents += 1
+        return record
+
+    async def run(self, documents, write):
+        """
+        Analyzes `documents` (any iterable, read lazily) and calls `write(record)`
+        as each one finishes, in completion order. Calls go out at batch priority.
+        """
+        documents = iter(documents)
+        pending = set()
+        exhausted = False
+        try:
+            # Tasks created in here inherit the priority, so a shared gateway serves interactive chat first
+            with request_priority(BATCH):
+                while pending or not exhausted:
+                    while not exhausted and len(pending) < self.max_documents:
+                        # Reading the next document may block on a pipe, so keep it off the event loop
+                        document = await asyncio.to_thread(next, documents, None)
+                        if document is None:
+                            exhausted = True
+                        else:
+                            pending.add(asyncio.create_task(self.analyze(document)))
+                    if pending:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            write(task.result())
+        finally:
+            for task in pending:
+                task.cancel()
+            self.invoker.shutdown()
+
+    def stats(self):
+        return {
+            "documents": self.documents,
+            "failed_calls": self.failed_calls,
+            "model": self.invoker.stats(),
+            "rate_limit": self.rate_limiter.stats(),
+        }
@@ -0,0 +1,63 @@
+import functools
+import json
+import uuid
+
+import boto3
+
+
+@functools.lru_cache(maxsize=None)
+def _clients(region_name):
+    return boto3.client("bedrock", region_name=region_name), boto3.client("s3", region_name=region_name)
+
+
+def anthropic_record(record_id, system_text, user_message, max_tokens=1024, temperature=0.5, stop_sequences=()):
+    """
+    Returns one Bedrock batch-inference record in the Anthropic Messages format.
+    """
+    model_input = {
+        "anthropic_version": "bedrock-2023-05-31",
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+        "system": system_text,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": user_message}]}],
+    }
+    if stop_sequences:
+        model_input["stop_sequences"] = list(stop_sequences)
+    return {"recordId": record_id, "modelInput": model_input}
+
+
+def submit_batch_job(records, model_id, bucket, role_arn, region_name, prefix="farmwise-batch"):
+    """
+    Uploads `records` as JSONL to S3 and starts a Bedrock model invocation job.
+
+    Results land under `s3://<bucket>/<prefix>/<job name>/output/`. Returns the job ARN.
+    """
+    bedrock, s3 = _clients(region_name)
+    job_name = f"farmwise-{uuid.uuid4().hex[:12]}"
+    input_key = f"{prefix}/{job_name}/input.jsonl"
+    s3.put_object(
+        Bucket=bucket,
+        Key=input_key,
+        Body="\n".join(json.dumps(record) for record in records).encode("utf-8"),
+    )
+    response = bedrock.create_model_invocation_job(
+        jobName=job_name,
+        roleArn=role_arn,
+        modelId=model_id,
+        inputDataConfig={"s3InputDataConfig": {"s3Uri": f"s3://{bucket}/{input_key}", "s3InputFormat": "JSONL"}},
+        outputDataConfig={"s3OutputDataConfig": {"s3Uri": f"s3://{bucket}/{prefix}/{job_name}/output/"}},
+    )
+    return response["jobArn"]
+
+
+def batch_job_status(job_arn, region_name):
+    """
+    Returns the status and output location of a model invocation job.
+    """
+    bedrock, _ = _clients(region_name)
+    job = bedrock.get_model_invocation_job(jobIdentifier=job_arn)
+    return {
+        "status": job["status"],
+        "message": job.get("message"),
+        "output_uri": job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"],
+    }
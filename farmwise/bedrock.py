@@ -0,0 +1,432 @@
+import asyncio
+import contextvars
+import functools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ConnectionError as BotoConnectionError
+
+from farmwise import metrics
+from farmwise.logs import log_event
+from farmwise.prompts import supports_prompt_cache
+from farmwise.rate_limit import AdaptiveRateLimiter, current_priority
+from farmwise.routing import error_code
+
+_DONE = object()
+
+# Errors worth another attempt on the same model; throttles also slow that model's send rate
+RETRYABLE_ERRORS = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+}
+
+PRIORITY_NAMES = {0: "interactive", 1: "batch"}
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+class ModelInvoker:
+    """
+    Runs blocking Bedrock calls on a dedicated thread pool so async request
+    handlers never block the event loop.
+
+    At most `max_concurrency` calls run at once; everything else waits in a
+    queue whose depth is reported by `stats()`.
+    """
+
+    def __init__(self, max_concurrency=8):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="bedrock"
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def _acquire(self):
+        if self._semaphore.locked():
+            self.queue_depth += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.queue_depth -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Calls `func(*args, **kwargs)` on the worker pool and returns its result.
+        """
+        await self._acquire()
+        try:
+            loop = asyncio.get_running_loop()
+            # Run in a copy of this context so the caller's request priority reaches the gateway
+            return await loop.run_in_executor(
+                self._executor, contextvars.copy_context().run, functools.partial(func, *args, **kwargs)
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self._release()
+
+    async def stream(self, func, *args, **kwargs):
+        """
+        Iterates the blocking iterator returned by `func(*args, **kwargs)` on
+        the worker pool and yields its items as they arrive.
+
+        The worker stops early if the consumer goes away (e.g. the client
+        disconnects mid-stream), freeing its slot for the next request.
+        """
+        await self._acquire()
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stopped = threading.Event()
+
+        def pump():
+            try:
+                for item in func(*args, **kwargs):
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, item)
+            except Exception as exc:
+                loop.call_soon_threadsafe(queue.put_nowait, _Failure(exc))
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+                # The slot is held until the worker thread is actually free
+                loop.call_soon_threadsafe(self._release)
+
+        loop.run_in_executor(self._executor, contextvars.copy_context().run, pump)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, _Failure):
+                    self.failed += 1
+                    raise item.error
+                yield item
+        finally:
+            stopped.set()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@dataclass
+class ModelResult:
+    """
+    Uniform outcome of one model call, whichever entry point made it.
+    """
+
+    text: str
+    model_id: str
+    stop_reason: str | None = None
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_tokens: int = 0
+    cache_write_tokens: int = 0
+    latency_ms: float = 0.0
+    first_token_ms: float | None = None
+    # Time from the successful attempt's send, without rate-limit queueing or earlier retries
+    service_ms: float | None = None
+
+    @classmethod
+    def from_usage(cls, text, model_id, stop_reason, usage, latency_ms, first_token_ms=None, service_ms=None):
+        return cls(
+            text=text,
+            model_id=model_id,
+            stop_reason=stop_reason,
+            input_tokens=usage.get("inputTokens", 0),
+            output_tokens=usage.get("outputTokens", 0),
+            cache_read_tokens=usage.get("cacheReadInputTokens", 0),
+            cache_write_tokens=usage.get("cacheWriteInputTokens", 0),
+            latency_ms=latency_ms,
+            first_token_ms=first_token_ms,
+            service_ms=service_ms,
+        )
+
+
+def _observe(result):
+    metrics.observe_model(result)
+    log_event(
+        "model_call",
+        model=result.model_id,
+        latency_ms=round(result.latency_ms),
+        first_token_ms=None if result.first_token_ms is None else round(result.first_token_ms),
+        input_tokens=result.input_tokens,
+        output_tokens=result.output_tokens,
+        cache_read_tokens=result.cache_read_tokens,
+        cache_write_tokens=result.cache_write_tokens,
+        stop_reason=result.stop_reason,
+    )
+
+
+def _strip_cache_points(blocks):
+    return [block for block in blocks if "cachePoint" not in block]
+
+
+def parse_model_limits(text):
+    """
+    Parses "model-id=limit,model-id=limit" (e.g. from BEDROCK_MODEL_LIMITS) into a dict.
+    """
+    limits = {}
+    for part in (text or "").split(","):
+        model_id, _, limit = part.strip().rpartition("=")
+        if model_id and limit.isdigit():
+            limits[model_id] = int(limit)
+    return limits
+
+
+class BedrockGateway:
+    """
+    Single entry point for Bedrock runtime calls.
+
+    Owns one tuned boto3 client (created on first use so importing an app
+    stays fast), caps how many calls each model may have in flight, and turns
+    every response into a ModelResult with token usage and latency.
+
+    Each model also gets an AdaptiveRateLimiter starting at `model_rates`
+    (requests per minute, else `default_rate`; unlimited until the first
+    throttle when neither is set) that backs off when the model throttles
+    and probes upwards while callers are queueing, so sustained load settles
+    at the account's quota. Calls wait their turn by the
+    priority of the request that made them (see farmwise.rate_limit) and
+    are retried here, up to `max_attempts` in all, on throttles and
+    transient errors; boto's own retries are off so they can't add a
+    second, uncoordinated retry storm.
+    """
+
+    def __init__(self, region_name="us-west-2", max_pool_connections=32, connect_timeout=5,
+                 read_timeout=120, max_attempts=4, model_limits=None, default_limit=8,
+                 model_rates=None, default_rate=None):
+        self.region_name = region_name
+        self.max_attempts = max_attempts
+        self.config = Config(
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 1, "mode": "standard"},
+            tcp_keepalive=True,
+        )
+        self.model_limits = dict(model_limits or {})
+        self.default_limit = default_limit
+        self.model_rates = dict(model_rates or {})
+        self.default_rate = default_rate
+        self._client = None
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._limiters = {}
+        self._stats = {}
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.client(
+                        service_name="bedrock-runtime", region_name=self.region_name, config=self.config
+                    )
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        # Lets benchmarks swap in a local stand-in for bedrock-runtime
+        self._client = client
+
+    def _slot(self, model_id):
+        with self._lock:
+            slot = self._slots.get(model_id)
+            if slot is None:
+                limit = self.model_limits.get(model_id, self.default_limit)
+                slot = self._slots[model_id] = threading.BoundedSemaphore(limit)
+                self._stats[model_id] = {"limit": limit, "in_flight": 0, "calls": 0, "errors": 0}
+            return slot
+
+    def _limiter(self, model_id):
+        with self._lock:
+            limiter = self._limiters.get(model_id)
+            if limiter is None:
+                limiter = self._limiters[model_id] = AdaptiveRateLimiter(
+                    self.model_rates.get(model_id, self.default_rate)
+                )
+            return limiter
+
+    def _send(self, model_id, call, keep_slot=False):
+        """
+        Returns `(call(), sent_at)` once the model's rate limiter and concurrency
+        slot allow it, retrying throttles and transient errors; `sent_at` is the
+        perf_counter time the successful attempt was sent. With `keep_slot` the
+        slot (and in-flight count) stay taken for the caller to release.
+        """
+        limiter = self._limiter(model_id)
+        slot = self._slot(model_id)
+        priority = current_priority()
+        for attempt in range(self.max_attempts):
+            waited = limiter.acquire(priority)
+            # Admission time, not send time: calls admitted at the old rate may still be waiting for a slot
+            admitted_at = time.monotonic()
+            metrics.MODEL_QUEUE_SECONDS.labels(model_id, PRIORITY_NAMES.get(priority, str(priority))).observe(waited)
+            slot.acquire()
+            self._track(model_id, in_flight=1, calls=1)
+            sent_at = time.perf_counter()
+            try:
+                response = call()
+            except Exception as exc:
+                self._track(model_id, in_flight=-1, errors=1)
+                slot.release()
+                metrics.observe_model_error(model_id, exc)
+                code = error_code(exc)
+                if code == "ThrottlingException":
+                    limiter.on_throttle(admitted_at)
+                retryable = code in RETRYABLE_ERRORS or isinstance(exc, BotoConnectionError)
+                if not retryable or attempt == self.max_attempts - 1:
+                    raise
+                # Jittered backoff; throttled retries then also wait their turn at the limiter
+                time.sleep(random.uniform(0, min(8, 0.25 * 2 ** attempt)))
+                continue
+            limiter.on_success()
+            if not keep_slot:
+                self._track(model_id, in_flight=-1)
+                slot.release()
+            return response, sent_at
+
+    def _track(self, model_id, in_flight=0, calls=0, errors=0):
+        with self._lock:
+            stats = self._stats[model_id]
+            stats["in_flight"] += in_flight
+            stats["calls"] += calls
+            stats["errors"] += errors
+
+    @staticmethod
+    def _request(model_id, messages, system, inference_config, extra):
+        if not supports_prompt_cache(model_id):
+            # Callers always mark cache points; drop them for models that would reject them
+            system = _strip_cache_points(system) if system else system
+            messages = [
+                {**message, "content": _strip_cache_points(message["content"])} for message in messages
+            ]
+        request = {"messages": messages, **extra}
+        if system:
+            request["system"] = system
+        if inference_config:
+            request["inferenceConfig"] = inference_config
+        return request
+
+    def converse(self, model_id, messages, system=None, inference_config=None, **extra):
+        """
+        Calls `converse` and returns a ModelResult. Blocks while the model is at its limit.
+        """
+        request = self._request(model_id, messages, system, inference_config, extra)
+        started = time.perf_counter()
+        response, sent_at = self._send(model_id, lambda: self.client.converse(modelId=model_id, **request))
+        # Includes time queued for the rate limit and any retries, as the caller sees it
+        finished = time.perf_counter()
+        latency_ms = (finished - started) * 1000
+
+        content = response["output"]["message"]["content"]
+        text = "".join(block.get("text", "") for block in content)
+        result = ModelResult.from_usage(
+            text, model_id, response.get("stopReason"), response.get("usage", {}), latency_ms,
+            service_ms=(finished - sent_at) * 1000,
+        )
+        _observe(result)
+        return result
+
+    def converse_stream(self, model_id, messages, system=None, inference_config=None, **extra):
+        """
+        Calls `converse_stream` and returns a ModelStream that yields text as it arrives.
+        """
+        return ModelStream(self, model_id, self._request(model_id, messages, system, inference_config, extra))
+
+    def stats(self):
+        with self._lock:
+            models = {model_id: dict(stats) for model_id, stats in self._stats.items()}
+            limiters = dict(self._limiters)
+        for model_id, limiter in limiters.items():
+            models.setdefault(model_id, {})["rate"] = limiter.stats()
+        return models
+
+
+class ModelStream:
+    """
+    Iterates the text deltas of a streamed model response.
+
+    Once iteration finishes, `result` holds the ModelResult for the whole
+    response, including time to first token.
+    """
+
+    def __init__(self, gateway, model_id, request):
+        self.gateway = gateway
+        self.model_id = model_id
+        self.request = request
+        self.result = None
+
+    def __iter__(self):
+        gateway, model_id = self.gateway, self.model_id
+        started = time.perf_counter()
+        # Opening the stream is retried like any call; once it is open the slot is ours until the end
+        response, sent_at = gateway._send(
+            model_id, lambda: gateway.client.converse_stream(modelId=model_id, **self.request), keep_slot=True
+        )
+        slot = gateway._slot(model_id)
+        chunks = []
+        first_token_ms = None
+        stop_reason = None
+        usage = {}
+        try:
+            for event in response["stream"]:
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"].get("text")
+                    if text:
+                        if first_token_ms is None:
+                            first_token_ms = (time.perf_counter() - started) * 1000
+                        chunks.append(text)
+                        yield text
+                elif "messageStop" in event:
+                    stop_reason = event["messageStop"].get("stopReason")
+                elif "metadata" in event:
+                    usage = event["metadata"].get("usage", {})
+        except Exception as exc:
+            gateway._track(model_id, errors=1)
+            metrics.observe_model_error(model_id, exc)
+            raise
+        finally:
+            gateway._track(model_id, in_flight=-1)
+            slot.release()
+        finished = time.perf_counter()
+        self.result = ModelResult.from_usage(
+            "".join(chunks), model_id, stop_reason, usage,
+            (finished - started) * 1000, first_token_ms, (finished - sent_at) * 1000,
+        )
+        _observe(self.result)
@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+
+# Bedrock models differ in how many stop sequences they accept; this is the smallest common limit
+MAX_STOP_SEQUENCES = 4
+
+USAGE_FIELDS = ("input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+
+
+class BudgetRejected(ValueError):
+    """
+    Raised for generation options a request is not allowed to use.
+    """
+
+
+@dataclass(frozen=True)
+class GenerationBudget:
+    """
+    How much one answer may generate: an output-token cap, whether it is a
+    brief answer (compact prompt, fewer references) and its stop sequences.
+    """
+
+    max_tokens: int
+    brief: bool = False
+    stop_sequences: tuple = ()
+    # "" for the endpoint's default budget; otherwise keeps differently sized answers apart in the caches
+    variant: str = ""
+
+    def inference_config(self, temperature=None):
+        config = {"maxTokens": self.max_tokens}
+        if temperature is not None:
+            config["temperature"] = temperature
+        if self.stop_sequences:
+            config["stopSequences"] = list(self.stop_sequences)
+        return config
+
+
+class BudgetPolicy:
+    """
+    An endpoint's generation budgets. Requests may ask for a brief answer,
+    fewer tokens or stop sequences, but never more than the mode's ceiling.
+    """
+
+    def __init__(self, max_tokens=1024, brief_max_tokens=256):
+        self.max_tokens = max_tokens
+        self.brief_max_tokens = brief_max_tokens
+
+    def resolve(self, brief=False, max_tokens=None, stop=None):
+        """
+        Returns the GenerationBudget for a request. Raises BudgetRejected for an
+        invalid `max_tokens` or `stop`.
+        """
+        ceiling = self.brief_max_tokens if brief else self.max_tokens
+        if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int)
+                                       or max_tokens < 1):
+            raise BudgetRejected("max_tokens must be a positive integer")
+        limit = min(ceiling, max_tokens or ceiling)
+
+        if isinstance(stop, str):
+            stop = [stop]
+        stop = tuple(stop or ())
+        if len(stop) > MAX_STOP_SEQUENCES or not all(isinstance(s, str) and s for s in stop):
+            raise BudgetRejected(f"stop must be at most {MAX_STOP_SEQUENCES} non-empty strings")
+
+        variant = ""
+        if brief or limit != self.max_tokens or stop:
+            variant = f"{'brief' if brief else 'full'}:{limit}:{'|'.join(stop)}"
+        return GenerationBudget(limit, brief, stop, variant)
+
+
+def token_usage(result=None):
+    """
+    Token counts of a ModelResult as a response field; all zero when the
+    request made no model call of its own (cache hit or shared generation).
+    """
+    return {field: getattr(result, field, 0) for field in USAGE_FIELDS}
@@ -0,0 +1,204 @@
+import asyncio
+import os
+
+from farmwise import metrics
+from farmwise.bedrock import BedrockGateway, ModelInvoker, parse_model_limits
+from farmwise.budgets import BudgetPolicy, token_usage
+from farmwise.geocode import Geocoder
+from farmwise.prompts import load_template
+from farmwise.response_cache import ResponseCache
+from farmwise.retrieval import INDEX_DIR, open_index
+from farmwise.routing import ModelRouter
+from farmwise.sessions import ConversationMemory, make_session_store, make_summarizer
+from farmwise.weather import WeatherService, make_providers
+from farmwise.weather_cache import WeatherCache
+from farmwise.weather_prefetch import WeatherPrefetcher
+
+# Model answers are pinned to when MODEL_ROUTING=off, and the one the router falls back to
+MODEL_ID = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+
+BEDROCK_REGION = "us-west-2"  # Choose the region where your Bedrock model is deployed
+
+
+def make_gateway(max_concurrency=8):
+    """
+    Returns a BedrockGateway with up to `max_concurrency` connections per model.
+    """
+    # The client itself is created on first use. BEDROCK_MODEL_RATES ("model-id=rpm,...") sets each
+    # model's starting send rate, which then adapts to throttling
+    return BedrockGateway(
+        region_name=BEDROCK_REGION,
+        max_pool_connections=max_concurrency,
+        model_limits=parse_model_limits(os.getenv("BEDROCK_MODEL_LIMITS")),
+        default_limit=max_concurrency,
+        model_rates=parse_model_limits(os.getenv("BEDROCK_MODEL_RATES")),
+        default_rate=float(os.getenv("BEDROCK_DEFAULT_RATE", "0")) or None,
+    )
+
+
+class AppComponents:
+    """
+    The environment-configured pieces every FARMWISE app answers questions with.
+
+    `prefix` picks the app's advisor templates (`<prefix>_advisor` and
+    `<prefix>_advisor_brief`) and `app_dir` is where its on-disk caches live;
+    `max_concurrency` bounds its Bedrock calls and `weather_providers` is the
+    default provider order when WEATHER_PROVIDERS is unset. Everything else is
+    read from the same environment variables, with the same defaults, in every app.
+    """
+
+    def __init__(self, prefix, app_dir, max_concurrency=8, temperature=0.5,
+                 weather_providers="openweathermap,open-meteo,weatherstack"):
+        self.temperature = temperature
+
+        self.bedrock_gateway = make_gateway(max_concurrency)
+
+        # Offloads the blocking boto3 calls so the event loop keeps serving requests
+        self.model_invoker = ModelInvoker(max_concurrency=max_concurrency)
+
+        # Sends short factual questions to Haiku and diagnostic or image ones to Sonnet, failing over on
+        # throttling; MODEL_ROUTING=off pins every request to MODEL_ID
+        self.model_router = ModelRouter(enabled=os.getenv("MODEL_ROUTING", "on") != "off")
+
+        # The advisor instructions never change and come first, behind a prompt-cache checkpoint once
+        # long enough (see CACHE_MIN_TOKENS); the references retrieved for each question go after them
+        self.advisor_prompt = load_template(f"{prefix}_advisor")
+        self.brief_advisor_prompt = load_template(f"{prefix}_advisor_brief")
+
+        # Agronomy passages and worked examples matched to each question, in place of fixed few-shot examples;
+        # the index is memory-mapped and (re)built from farmwise/data/agronomy at start when missing or out of date
+        self.knowledge_index = open_index(os.getenv("KNOWLEDGE_INDEX", INDEX_DIR))
+        self.retrieval_passages = int(os.getenv("RETRIEVAL_PASSAGES", "3"))
+        self.retrieval_examples = int(os.getenv("RETRIEVAL_EXAMPLES", "1"))
+        self.brief_retrieval_passages = int(os.getenv("BRIEF_RETRIEVAL_PASSAGES", "1"))
+
+        # Output-token ceilings for full and "brief" text answers; requests may ask for less. Brief answers
+        # use a compact prompt and fewer references so they come back fast on slow rural connections
+        self.budgets = BudgetPolicy(
+            max_tokens=int(os.getenv("MAX_OUTPUT_TOKENS", "1024")),
+            brief_max_tokens=int(os.getenv("BRIEF_MAX_OUTPUT_TOKENS", "256")),
+        )
+
+        # Longest the weather lookup may add to a request before we answer without it
+        self.weather_deadline = float(os.getenv("WEATHER_DEADLINE_SECONDS", "1.5"))
+
+        # Current conditions per ~1 km cell, so farms in the same area share a lookup. Expired conditions
+        # are kept for WEATHER_STALE_SECONDS and served when every weather provider is down
+        self.weather_cache = WeatherCache(
+            ttl=int(os.getenv("WEATHER_CACHE_TTL", "600")),
+            max_entries=int(os.getenv("WEATHER_CACHE_SIZE", "1024")),
+            precision=int(os.getenv("WEATHER_CACHE_PRECISION", "2")),
+            stale_for=int(os.getenv("WEATHER_STALE_SECONDS", str(6 * 3600))),
+        )
+
+        # Weather providers in order of preference (those without an API key are skipped); a slow provider
+        # is hedged with the next one after its p95 latency, and a failing one is cut off by its circuit breaker
+        self.weather_service = WeatherService(
+            make_providers(
+                os.getenv("WEATHER_PROVIDERS", weather_providers),
+                openweathermap_key=os.getenv("OPEN_WEATHER_API"),
+                weatherstack_key=os.getenv("WEATHER_API_KEY"),
+            ),
+            hedge_after=float(os.getenv("WEATHER_HEDGE_AFTER_SECONDS", "0.5")),
+        )
+
+        # Re-fetches weather for recently active locations before it expires, so requests read a warm cache;
+        # WEATHER_PREFETCH_PER_MINUTE caps its upstream calls (0 turns it off)
+        self.weather_prefetcher = WeatherPrefetcher(
+            self.weather_cache,
+            per_minute=float(os.getenv("WEATHER_PREFETCH_PER_MINUTE", "10")),
+            max_locations=int(os.getenv("WEATHER_PREFETCH_LOCATIONS", "500")),
+        )
+
+        # Resolves free-text farm locations to coordinates: bundled gazetteer, then a persistent cache, then upstream
+        self.geocoder = Geocoder(
+            cache_path=os.getenv("GEOCODE_CACHE_PATH", os.path.join(app_dir, ".cache", "geocode.json")),
+            upstream=os.getenv("GEOCODE_UPSTREAM", "on") != "off",
+            max_entries=int(os.getenv("GEOCODE_CACHE_SIZE", "10000")),
+            miss_ttl=int(os.getenv("GEOCODE_MISS_TTL", str(24 * 3600))),
+        )
+
+        # Answers keyed by normalized question, location and weather bucket
+        self.response_cache = ResponseCache(
+            ttl=int(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "2048")),
+            semantic=os.getenv("RESPONSE_CACHE_SEMANTIC", "0") == "1",
+            similarity=float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.9")),
+        )
+
+        # Follow-up context per session_id: recent turns verbatim, older ones summarized; SESSION_DB persists it in SQLite
+        self.conversation_memory = ConversationMemory(
+            make_session_store(
+                os.getenv("SESSION_DB"),
+                max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+                ttl=int(os.getenv("SESSION_TTL", str(24 * 3600))),
+            ),
+            make_summarizer(self.bedrock_gateway),
+            token_budget=int(os.getenv("SESSION_TOKEN_BUDGET", "1500")),
+            keep_turns=int(os.getenv("SESSION_KEEP_TURNS", "2")),
+        )
+
+        metrics.register_cache("weather", self.weather_cache)
+        metrics.register_cache("response", self.response_cache)
+
+        self._prefetch_task = None
+
+    def start(self):
+        """
+        Starts the weather prefetcher, unless WEATHER_PREFETCH_PER_MINUTE turned it off.
+        Call from the app's lifespan, once the event loop is running.
+        """
+        if self.weather_prefetcher.per_minute > 0:
+            self._prefetch_task = asyncio.create_task(self.weather_prefetcher.run())
+
+    async def aclose(self):
+        """
+        Stops the prefetcher and the Bedrock thread pool and writes out the geocode cache.
+        """
+        if self._prefetch_task is not None:
+            self._prefetch_task.cancel()
+            self._prefetch_task = None
+        self.model_invoker.shutdown()
+        await self.geocoder.aclose()
+
+    def references(self, question, brief=False):
+        """
+        Returns the agronomy passages and worked example most relevant to the question.
+        Brief answers get fewer passages and no example, whose step-by-step format would make them long.
+        """
+        if brief:
+            return self.knowledge_index.references(question, self.brief_retrieval_passages, 0)
+        return self.knowledge_index.references(question, self.retrieval_passages, self.retrieval_examples)
+
+    def converse(self, system_prompts, messages, task="diagnostic", budget=None):
+        """
+        Sends messages to the Claude model on AWS Bedrock and returns the ModelResult.
+        The router picks the model for `task` and fails over if it is throttled.
+        """
+        inference_config = (budget or self.budgets.resolve()).inference_config(self.temperature)
+
+        return self.model_router.call(
+            task,
+            MODEL_ID,
+            lambda model_id: self.bedrock_gateway.converse(
+                model_id, messages, system=system_prompts, inference_config=inference_config
+            ),
+        )
+
+    def converse_stream(self, system_prompts, messages, task="diagnostic", budget=None, usage=None):
+        """
+        Streams the Claude model's response from AWS Bedrock, yielding text as it is generated,
+        and fills in the `usage` dict, if given, once it is done.
+        Messages may contain image blocks alongside text.
+        """
+        inference_config = (budget or self.budgets.resolve()).inference_config(self.temperature)
+
+        result = yield from self.model_router.stream(
+            task,
+            MODEL_ID,
+            lambda model_id: self.bedrock_gateway.converse_stream(
+                model_id, messages, system=system_prompts, inference_config=inference_config
+            ),
+        )
+        if usage is not None and result is not None:
+            usage.update(token_usage(result))
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from farmwise.logs import log_event
+from farmwise.response_cache import normalize_prompt
+
+
+class DiagnosisCache:
+    """
+    On-disk cache of image diagnoses keyed by perceptual image hash and the
+    normalized question (plus the answer variant, e.g. a brief answer).
+
+    A lookup matches any stored photo whose hash is within `max_distance` bits
+    of the new one, so re-uploads and light crops of the same photo hit. The
+    directory is kept under `max_bytes` by evicting the least recently used
+    entries.
+
+    Several worker processes may share the directory: each rescans it every
+    `rescan_after` seconds (and before evicting) to pick up the others'
+    entries, so hits and the size cap cover every worker. Files another
+    worker removes are skipped, and failing to store an entry is logged,
+    never raised.
+    """
+
+    def __init__(self, directory, max_bytes=50 * 1024 * 1024, max_distance=6, rescan_after=30.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.rescan_after = rescan_after
+        self._lock = threading.Lock()
+        # question key -> {file name: image hash}
+        self._index = {}
+        self._sizes = {}
+        self._scanned_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        index, sizes = {}, {}
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            image_hash, _, question_key = name[:-len(".json")].partition("-")
+            try:
+                image_hash = int(image_hash, 16)
+                sizes[name] = os.path.getsize(os.path.join(self.directory, name))
+            except (ValueError, OSError):
+                continue
+            index.setdefault(question_key, {})[name] = image_hash
+        self._index, self._sizes = index, sizes
+        self._scanned_at = time.monotonic()
+
+    def _refresh(self):
+        if time.monotonic() - self._scanned_at >= self.rescan_after:
+            try:
+                self._load_index()
+            except OSError as exc:
+                log_event("diagnosis_cache_scan_failed", level=logging.WARNING, error=repr(exc))
+
+    @staticmethod
+    def _question_key(question, variant=""):
+        # The default variant hashes to the same key as before variants existed
+        return hashlib.sha1((normalize_prompt(question) + variant).encode()).hexdigest()[:16]
+
+    def get(self, image_hash, question, variant=""):
+        """
+        Returns the cached diagnosis for a matching photo and question, or None.
+        """
+        question_key = self._question_key(question, variant)
+        with self._lock:
+            self._refresh()
+            best_name, best_distance = None, self.max_distance + 1
+            for name, stored_hash in self._index.get(question_key, {}).items():
+                distance = bin(stored_hash ^ image_hash).count("1")
+                if distance < best_distance:
+                    best_name, best_distance = name, distance
+            if best_name is None:
+                self.misses += 1
+                return None
+            path = os.path.join(self.directory, best_name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+                # Bump the modification time so eviction sees this entry as recently used
+                os.utime(path)
+            except (OSError, ValueError):
+                self._forget(best_name, question_key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry["response"]
+
+    def put(self, image_hash, question, response, variant=""):
+        """
+        Stores a diagnosis; a failure (full disk, directory removed) is logged and the entry skipped.
+        """
+        question_key = self._question_key(question, variant)
+        name = f"{image_hash:016x}-{question_key}.json"
+        payload = json.dumps({
+            "question": question,
+            "response": response,
+            "created": time.time(),
+        }).encode("utf-8")
+        with self._lock:
+            tmp_path = None
+            try:
+                # Write to a temp file first so readers never see a partial entry
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(payload)
+                os.replace(tmp_path, os.path.join(self.directory, name))
+            except OSError as exc:
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                log_event("diagnosis_cache_put_failed", level=logging.WARNING, error=repr(exc))
+                return
+            self._index.setdefault(question_key, {})[name] = image_hash
+            self._sizes[name] = len(payload)
+            if sum(self._sizes.values()) > self.max_bytes:
+                # Other workers' entries count towards the cap too
+                self._scanned_at = 0.0
+                self._refresh()
+                self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% so the next few puts don't each rescan and evict again
+        target = self.max_bytes * 0.9
+        modified = {}
+        for name in list(self._sizes):
+            try:
+                modified[name] = os.path.getmtime(os.path.join(self.directory, name))
+            except OSError:
+                # Already removed by another worker or an outside cleanup
+                total -= self._sizes[name]
+                self._forget(name, name[:-len(".json")].partition("-")[2])
+        for name in sorted(modified, key=modified.get):
+            if total <= target:
+                break
+            total -= self._sizes[name]
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            self._forget(name, name[:-len(".json")].partition("-")[2])
+            self.evictions += 1
+
+    def _forget(self, name, question_key):
+        self._sizes.pop(name, None)
+        entries = self._index.get(question_key)
+        if entries is not None:
+            entries.pop(name, None)
+            if not entries:
+                del self._index[question_key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._sizes),
+                "bytes": sum(self._sizes.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,289 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from farmwise import http_clients
+from farmwise.logs import log_event
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "gazetteer.csv")
+
+# Keyless geocoding service used for places that are not in the gazetteer
+GEOCODING_URL = "https://geocoding-api.open-meteo.com/v1/search"
+
+US_STATES = {
+    "al": "alabama", "ak": "alaska", "az": "arizona", "ar": "arkansas", "ca": "california",
+    "co": "colorado", "ct": "connecticut", "de": "delaware", "fl": "florida", "ga": "georgia",
+    "hi": "hawaii", "id": "idaho", "il": "illinois", "in": "indiana", "ia": "iowa",
+    "ks": "kansas", "ky": "kentucky", "la": "louisiana", "me": "maine", "md": "maryland",
+    "ma": "massachusetts", "mi": "michigan", "mn": "minnesota", "ms": "mississippi", "mo": "missouri",
+    "mt": "montana", "ne": "nebraska", "nv": "nevada", "nh": "new hampshire", "nj": "new jersey",
+    "nm": "new mexico", "ny": "new york", "nc": "north carolina", "nd": "north dakota", "oh": "ohio",
+    "ok": "oklahoma", "or": "oregon", "pa": "pennsylvania", "ri": "rhode island", "sc": "south carolina",
+    "sd": "south dakota", "tn": "tennessee", "tx": "texas", "ut": "utah", "vt": "vermont",
+    "va": "virginia", "wa": "washington", "wv": "west virginia", "wi": "wisconsin", "wy": "wyoming",
+    "dc": "district of columbia",
+}
+
+# Common spellings of the same state (beyond the postal codes)
+STATE_ALIASES = {"kan": "kansas", "kans": "kansas", "neb": "nebraska", "nebr": "nebraska", "okla": "oklahoma",
+                 "minn": "minnesota", "wis": "wisconsin", "mich": "michigan", "ill": "illinois", "ind": "indiana"}
+
+STATE_NAMES = set(US_STATES.values())
+
+# Trailing words that say nothing about which town is meant
+COUNTRY_WORDS = re.compile(r"\b(usa|us|united states( of america)?|america)$")
+
+
+@dataclass(frozen=True)
+class Place:
+    name: str
+    state: str | None
+    lat: float
+    lon: float
+
+    @property
+    def label(self):
+        return f"{self.name}, {self.state}" if self.state else self.name
+
+
+def _words(text):
+    text = re.sub(r"[^\w\s]+", " ", text.lower())
+    text = re.sub(r"\s+", " ", text).strip()
+    text = COUNTRY_WORDS.sub("", text).strip()
+    text = re.sub(r"^st\b", "saint", text)
+    return re.sub(r"^ft\b", "fort", text)
+
+
+def normalize_location(text):
+    """
+    Splits a free-text location into a normalized `(city, state)`, e.g.
+    "Lawrence, KS" and "lawrence kansas" both give ("lawrence", "kansas").
+    `state` is None when no US state is recognized.
+    """
+    words = _words(text or "").split()
+    for size in (3, 2, 1):
+        if len(words) > size:
+            tail = " ".join(words[-size:])
+            state = US_STATES.get(tail) or STATE_ALIASES.get(tail) or (tail if tail in STATE_NAMES else None)
+            if state:
+                return " ".join(words[:-size]), state
+    return " ".join(words), None
+
+
+class Geocoder:
+    """
+    Resolves free-text farm locations to coordinates.
+
+    Places are looked up in the bundled gazetteer first, then in a persistent
+    JSON cache of earlier upstream answers, and only then upstream. A city
+    without a state resolves to its most populous namesake in the gazetteer.
+
+    The cache keeps the `max_entries` most recently used answers; places
+    upstream did not know are remembered for `miss_ttl` seconds only. Changes
+    are written to `cache_path` off the event loop at most every
+    `flush_after` seconds (and by `flush()` at shutdown), merged with what
+    other worker processes have written there.
+    """
+
+    def __init__(self, gazetteer_path=GAZETTEER_PATH, cache_path=None, upstream=True, max_entries=10000,
+                 miss_ttl=24 * 3600, flush_after=30.0):
+        self.cache_path = cache_path
+        self.upstream = upstream
+        self.max_entries = max_entries
+        self.miss_ttl = miss_ttl
+        self.flush_after = flush_after
+        self._places = {}
+        self._by_city = {}
+        with open(gazetteer_path, newline="", encoding="utf-8") as gazetteer:
+            for row in csv.DictReader(gazetteer):
+                place = Place(row["name"], row["state"], float(row["lat"]), float(row["lon"]))
+                city, state = normalize_location(f"{row['name']} {row['state']}")
+                self._places[(city, state)] = place
+                self._by_city.setdefault(city, []).append((int(row["population"]), place))
+        for candidates in self._by_city.values():
+            candidates.sort(key=lambda candidate: -candidate[0])
+
+        # key -> Place, or the wall-clock time a remembered miss expires
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flush_task = None
+        self._dirty = False
+        self.local_hits = 0
+        self.upstream_calls = 0
+        self.evictions = 0
+        for key, value in self._read_cache_file().items():
+            self._store(key, value)
+
+    def _read_cache_file(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError) as exc:
+            log_event("geocode_cache_unreadable", level=logging.WARNING, error=repr(exc))
+            return {}
+        # Places are [name, state, lat, lon], misses their expiry time; older files stored misses as null
+        return {
+            key: Place(*value) if isinstance(value, list) else value
+            for key, value in entries.items()
+            if isinstance(value, list) or (isinstance(value, (int, float)) and value > time.time())
+        }
+
+    def _store(self, key, value):
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def _cached(self, key):
+        """
+        Returns `(known, place)` for a cache key; expired misses are dropped and count as unknown.
+        """
+        with self._lock:
+            value = self._cache.get(key)
+            if value is None:
+                return False, None
+            if not isinstance(value, Place):
+                if value <= time.time():
+                    del self._cache[key]
+                    return False, None
+                return True, None
+            self._cache.move_to_end(key)
+            return True, value
+
+    @staticmethod
+    def _cache_key(city, state):
+        return f"{city}|{state or ''}"
+
+    def lookup(self, text):
+        """
+        Returns the Place for `text` from local data only, or None.
+        """
+        city, state = normalize_location(text)
+        if not city:
+            return None
+        place = self._places.get((city, state))
+        if place is None and state is None and city in self._by_city:
+            place = self._by_city[city][0][1]
+        if place is not None:
+            return place
+        return self._cached(self._cache_key(city, state))[1]
+
+    async def aresolve(self, text):
+        """
+        Returns the Place for `text`, asking the upstream geocoder at most once
+        per normalized location (concurrent callers share the answer).
+        """
+        place = self.lookup(text)
+        city, state = normalize_location(text)
+        key = self._cache_key(city, state)
+        if place is not None or not city or not self.upstream or self._cached(key)[0]:
+            self.local_hits += place is not None
+            return place
+
+        pending = self._pending.get(key)
+        if pending is None:
+            # Its own task, so the lookup outlives whichever caller happened to start it
+            pending = self._pending[key] = asyncio.ensure_future(self._resolve_upstream(key, city, state, text))
+            pending.add_done_callback(lambda _: self._pending.pop(key, None))
+        # Shielded: a caller that gives up (e.g. on a request deadline) must not cancel the lookup for the others
+        return await asyncio.shield(pending)
+
+    async def _resolve_upstream(self, key, city, state, text):
+        try:
+            place = await self._fetch(city, state)
+        except Exception as exc:
+            # Not remembered, so the next request tries again
+            log_event("geocode_failed", level=logging.WARNING, location=text, error=repr(exc))
+            return None
+        self._remember(key, place)
+        return place
+
+    async def _fetch(self, city, state):
+        self.upstream_calls += 1
+        response = await http_clients.aget(
+            GEOCODING_URL, params={"name": city, "count": 10, "language": "en", "format": "json"}
+        )
+        response.raise_for_status()
+        for result in response.json().get("results", []):
+            if state is None or (result.get("country_code") == "US" and (result.get("admin1") or "").lower() == state):
+                return Place(result["name"], result.get("admin1"), result["latitude"], result["longitude"])
+        return None
+
+    def _remember(self, key, place):
+        self._store(key, place if place is not None else time.time() + self.miss_ttl)
+        if not self.cache_path:
+            return
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_after)
+        try:
+            await asyncio.to_thread(self.flush)
+        except OSError as exc:
+            log_event("geocode_cache_write_failed", level=logging.WARNING, error=repr(exc))
+
+    def flush(self):
+        """
+        Writes the cache to `cache_path` if it changed, keeping entries other processes added.
+        """
+        if not self.cache_path or not self._dirty:
+            return
+        self._dirty = False
+        on_disk = self._read_cache_file()
+        with self._lock:
+            ours = dict(self._cache)
+        merged = {**on_disk, **ours}
+        # Ours are the most recently used; fill up with the others' entries to the same cap
+        keep = list(ours)[-self.max_entries:]
+        keep += [key for key in on_disk if key not in ours][:max(0, self.max_entries - len(keep))]
+        snapshot = {
+            key: [merged[key].name, merged[key].state, merged[key].lat, merged[key].lon]
+            if isinstance(merged[key], Place) else merged[key]
+            for key in keep
+        }
+        directory = os.path.dirname(self.cache_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        try:
+            # Write to a temp file and rename so a crash never leaves a half-written cache
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+                json.dump(snapshot, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except OSError:
+            self._dirty = True
+            raise
+
+    async def aclose(self):
+        """
+        Writes any pending changes; call at shutdown.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+        try:
+            await asyncio.to_thread(self.flush)
+        except OSError as exc:
+            log_event("geocode_cache_write_failed", level=logging.WARNING, error=repr(exc))
+
+    def stats(self):
+        return {
+            "gazetteer_places": len(self._places),
+            "cached_places": len(self._cache),
+            "evictions": self.evictions,
+            "local_hits": self.local_hits,
+            "upstream_calls": self.upstream_calls,
+        }
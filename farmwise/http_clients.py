@@ -0,0 +1,123 @@
+import asyncio
+import importlib.util
+import os
+import random
+import threading
+import time
+
+import httpx
+
+# Statuses worth retrying: rate limiting and transient upstream failures
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_async_client = None
+_sync_client = None
+_transport = None
+_lock = threading.Lock()
+
+
+def _client_options():
+    options = {
+        "timeout": httpx.Timeout(
+            float(os.getenv("HTTP_READ_TIMEOUT", "5")),
+            connect=float(os.getenv("HTTP_CONNECT_TIMEOUT", "3")),
+        ),
+        "limits": httpx.Limits(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=30,
+        ),
+        # HTTP/2 needs the optional `h2` package; fall back to HTTP/1.1 keep-alive
+        "http2": importlib.util.find_spec("h2") is not None,
+    }
+    if _transport is not None:
+        options["transport"] = _transport
+    return options
+
+
+def use_transport(transport):
+    """
+    Sends all shared-client traffic through `transport` (e.g. a local stub for
+    benchmarks). Applies to clients created after the call.
+    """
+    global _transport
+    _transport = transport
+
+
+def get_async_client():
+    """
+    Returns the process-wide `httpx.AsyncClient`, creating it on first use.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(**_client_options())
+    return _async_client
+
+
+def get_sync_client():
+    """
+    Returns the process-wide `httpx.Client`, creating it on first use.
+    """
+    global _sync_client
+    with _lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(**_client_options())
+        return _sync_client
+
+
+def _backoff(attempt, base):
+    return base * (2 ** attempt) * (0.5 + random.random())
+
+
+async def aget(url, params=None, retries=2, backoff=0.25):
+    """
+    GETs `url` with the shared async client, retrying transport errors and
+    retryable statuses with jittered exponential backoff.
+    """
+    client = get_async_client()
+    for attempt in range(retries + 1):
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        await asyncio.sleep(_backoff(attempt, backoff))
+
+
+def get(url, params=None, retries=2, backoff=0.25):
+    """
+    Blocking counterpart of `aget` using the shared sync client.
+    """
+    client = get_sync_client()
+    for attempt in range(retries + 1):
+        try:
+            response = client.get(url, params=params)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+        time.sleep(_backoff(attempt, backoff))
+
+
+async def aclose():
+    """
+    Closes the shared clients; call from the app's shutdown hook.
+    """
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+    close()
+
+
+def close():
+    global _sync_client
+    with _lock:
+        if _sync_client is not None:
+            _sync_client.close()
+            _sync_client = None
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import io
+import threading
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Formats the Converse API accepts as-is; anything else is re-encoded to JPEG
+CONVERSE_FORMATS = {"JPEG": "jpeg", "PNG": "png", "WEBP": "webp", "GIF": "gif"}
+
+
+class ImageRejected(ValueError):
+    """
+    Raised when an uploaded image is too large (`status_code` 413) or
+    malformed or undecodable (400).
+    """
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ImageIngest:
+    """
+    Validates and normalizes crop photos before they are sent to the model.
+
+    Uploads are checked against `max_bytes` before decoding and against
+    `max_pixels` from the image header alone, then downscaled so the longest
+    edge is at most `max_edge`. Only `max_concurrent` images are decoded at
+    once, which bounds peak memory when many photos arrive together.
+    """
+
+    def __init__(self, max_bytes=10 * 1024 * 1024, max_pixels=50_000_000, max_edge=1568, max_concurrent=4):
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.max_edge = max_edge
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+
+    def decode_base64(self, data):
+        """
+        Decodes a base64 image payload, rejecting it before decoding if it is too large.
+        """
+        if len(data) * 3 // 4 > self.max_bytes:
+            raise ImageRejected(f"Image exceeds {self.max_bytes // (1024 * 1024)} MB", 413)
+        try:
+            return base64.b64decode(data, validate=True)
+        except (binascii.Error, ValueError) as exc:
+            raise ImageRejected("Image is not valid base64") from exc
+
+    def read_upload(self, stream):
+        """
+        Reads a multipart upload stream, stopping as soon as it exceeds `max_bytes`.
+        """
+        raw = stream.read(self.max_bytes + 1)
+        if len(raw) > self.max_bytes:
+            raise ImageRejected(f"Image exceeds {self.max_bytes // (1024 * 1024)} MB", 413)
+        return raw
+
+    def normalize(self, raw):
+        """
+        Returns `(image_bytes, format)` ready for a Converse image block.
+
+        Small images in a supported format are passed through untouched;
+        everything else is decoded, downscaled and re-encoded as JPEG.
+        """
+        with self._slots:
+            try:
+                image = Image.open(io.BytesIO(raw))
+            except (UnidentifiedImageError, Image.DecompressionBombError) as exc:
+                raise ImageRejected("Upload is not a supported image") from exc
+            except (OSError, SyntaxError, ValueError) as exc:
+                # Recognized format, but the header itself is cut short or corrupt
+                raise ImageRejected("Image is corrupt or truncated") from exc
+
+            width, height = image.size
+            if width * height > self.max_pixels:
+                raise ImageRejected(f"Image has more than {self.max_pixels} pixels", 413)
+
+            # Image.open only reads the header; a truncated or corrupt body fails while decoding below
+            try:
+                image_format = CONVERSE_FORMATS.get(image.format)
+                if image_format and max(width, height) <= self.max_edge:
+                    # Decode once anyway so a broken small image is rejected here, not by the model
+                    image.load()
+                    return raw, image_format
+
+                # Let the JPEG decoder scale down while decoding instead of inflating the full image
+                image.draft("RGB", (self.max_edge, self.max_edge))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((self.max_edge, self.max_edge), Image.LANCZOS)
+                if image.mode not in ("RGB", "L"):
+                    image = image.convert("RGB")
+                with io.BytesIO() as buffer:
+                    image.save(buffer, "jpeg", quality=85, optimize=True)
+                    return buffer.getvalue(), "jpeg"
+            except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as exc:
+                raise ImageRejected("Image is corrupt or truncated") from exc
+
+
+def image_block(image_bytes, image_format):
+    """
+    Wraps raw image bytes as a Converse message content block.
+    """
+    return {"image": {"format": image_format, "source": {"bytes": image_bytes}}}
+
+
+def perceptual_hash(image_bytes):
+    """
+    Returns a 64-bit difference hash (dHash) of the image.
+
+    Re-encoded, resized or lightly cropped copies of a photo hash to values
+    only a few bits apart, unlike a byte-level digest.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft("L", (64, 64))
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (left > right)
+    return value
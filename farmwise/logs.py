@@ -0,0 +1,32 @@
+import json
+import logging
+import os
+import random
+import sys
+
+logger = logging.getLogger("farmwise")
+
+# Fraction of routine events that are logged; warnings and errors are always kept
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+
+
+def configure_logging(level=None):
+    """
+    Sends farmwise events to stderr as one JSON object per line.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level or os.getenv("LOG_LEVEL", "INFO"))
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Logs a structured event. Events below WARNING are sampled at LOG_SAMPLE_RATE.
+    """
+    if level < logging.WARNING and random.random() >= LOG_SAMPLE_RATE:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, default=str))
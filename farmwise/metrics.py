@@ -0,0 +1,140 @@
+import os
+import tempfile
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Set when the app runs as several worker processes: each worker writes its samples to this directory
+# and a scrape of any worker aggregates all of them. Must be set before the workers start
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Seconds buckets sized for upstream calls that range from cache-warm lookups to long generations
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 1.5, 2.5, 5, 10, 20, 40, 80)
+
+# Byte buckets for crop photos, from thumbnails to the upload limit
+IMAGE_BUCKETS = (16e3, 64e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+
+WEATHER_SECONDS = Histogram(
+    "farmwise_weather_seconds", "Upstream weather API latency.", ["provider"], buckets=LATENCY_BUCKETS
+)
+PROMPT_BUILD_SECONDS = Histogram(
+    "farmwise_prompt_build_seconds",
+    "Time from request arrival until the model prompt is ready, including the weather wait.",
+    ["app"],
+    buckets=LATENCY_BUCKETS,
+)
+MODEL_SECONDS = Histogram(
+    "farmwise_model_seconds", "Bedrock call latency, end to end.", ["model"], buckets=LATENCY_BUCKETS
+)
+MODEL_QUEUE_SECONDS = Histogram(
+    "farmwise_model_queue_seconds",
+    "Time Bedrock calls waited for their model's adaptive send rate, by request priority.",
+    ["model", "priority"],
+    buckets=(0, 0.01, *LATENCY_BUCKETS),
+)
+FIRST_TOKEN_SECONDS = Histogram(
+    "farmwise_first_token_seconds", "Time to first token of streamed responses.", ["model"], buckets=LATENCY_BUCKETS
+)
+MODEL_TOKENS = Counter("farmwise_model_tokens_total", "Tokens billed by Bedrock.", ["model", "kind"])
+MODEL_ERRORS = Counter("farmwise_model_errors_total", "Failed Bedrock calls.", ["model", "code"])
+REQUESTS_REJECTED = Counter(
+    "farmwise_requests_rejected_total", "Requests turned away by admission control.", ["reason"]
+)
+IMAGE_BYTES = Histogram(
+    "farmwise_image_bytes", "Size of crop photos as uploaded and as sent to the model.", ["stage"],
+    buckets=IMAGE_BUCKETS,
+)
+
+
+def observe_model(result):
+    """
+    Records latency and token usage of a ModelResult.
+    """
+    MODEL_SECONDS.labels(result.model_id).observe(result.latency_ms / 1000)
+    if result.first_token_ms is not None:
+        FIRST_TOKEN_SECONDS.labels(result.model_id).observe(result.first_token_ms / 1000)
+    for kind, count in (
+        ("input", result.input_tokens),
+        ("output", result.output_tokens),
+        ("cache_read", result.cache_read_tokens),
+        ("cache_write", result.cache_write_tokens),
+    ):
+        if count:
+            MODEL_TOKENS.labels(result.model_id, kind).inc(count)
+
+
+def observe_model_error(model_id, exc):
+    code = getattr(exc, "response", {}).get("Error", {}).get("Code") or type(exc).__name__
+    MODEL_ERRORS.labels(model_id, code).inc()
+
+
+class CacheCollector:
+    """
+    Exposes the hit/miss counters every cache already keeps in `stats()`,
+    so lookups are not counted twice.
+
+    These live in each process, so with several workers they describe the
+    worker that answered the scrape and carry its pid as a `worker` label.
+    """
+
+    # stats() keys reported as lookup results
+    RESULTS = ("hits", "semantic_hits", "coalesced", "misses")
+
+    def __init__(self):
+        self.caches = {}
+
+    def collect(self):
+        worker = [str(os.getpid())] if MULTIPROC_DIR else []
+        extra = ["worker"] if MULTIPROC_DIR else []
+        lookups = CounterMetricFamily(
+            "farmwise_cache_lookups", "Cache lookups by result.", labels=["cache", "result", *extra]
+        )
+        entries = GaugeMetricFamily("farmwise_cache_entries", "Entries currently cached.", labels=["cache", *extra])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            for result in self.RESULTS:
+                if result in stats:
+                    lookups.add_metric([name, result, *worker], stats[result])
+            entries.add_metric([name, *worker], stats.get("size", stats.get("entries", 0)))
+        yield lookups
+        yield entries
+
+
+_cache_collector = CacheCollector()
+REGISTRY.register(_cache_collector)
+
+
+def register_cache(name, cache):
+    """
+    Publishes a cache's hit and miss counts on /metrics under `name`.
+    """
+    _cache_collector.caches[name] = cache
+
+
+def prepare_multiprocess():
+    """
+    Sets up PROMETHEUS_MULTIPROC_DIR (a temporary directory unless already
+    set) for worker processes started after this call, clearing samples left
+    by an earlier run. Call it in the parent before starting several workers.
+    """
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR") or tempfile.mkdtemp(prefix="farmwise-metrics-")
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".db"):
+            os.remove(os.path.join(directory, name))
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+    return directory
+
+
+def render():
+    """
+    Returns the `(body, content type)` of a Prometheus scrape, aggregated over
+    all worker processes when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    if not MULTIPROC_DIR:
+        return generate_latest(), CONTENT_TYPE_LATEST
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(_cache_collector)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
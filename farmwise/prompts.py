@@ -0,0 +1,77 @@
+import functools
+import os
+
+from farmwise.sessions import estimate_tokens
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# Separates the static, cacheable part of a template from its per-request context
+CONTEXT_MARKER = "### CONTEXT ###"
+
+# Bedrock ignores cache checkpoints on prefixes shorter than this, so shorter prefixes get none
+CACHE_MIN_TOKENS = 1024
+
+# Model families that accept Bedrock prompt-cache checkpoints
+CACHE_POINT_MODELS = (
+    "anthropic.claude-3-5-haiku",
+    "anthropic.claude-3-7-sonnet",
+    "anthropic.claude-sonnet-4",
+    "anthropic.claude-opus-4",
+    "amazon.nova",
+)
+
+
+def supports_prompt_cache(model_id):
+    """
+    Returns whether `model_id` should receive cache checkpoints.
+
+    BEDROCK_PROMPT_CACHING=on/off overrides the built-in model list.
+    """
+    setting = os.getenv("BEDROCK_PROMPT_CACHING", "auto").lower()
+    if setting in ("on", "off"):
+        return setting == "on"
+    # Cross-region inference profiles prefix the model id with a geography
+    base_id = model_id.split(".", 1)[1] if model_id.split(".", 1)[0] in ("us", "eu", "apac") else model_id
+    return base_id.startswith(CACHE_POINT_MODELS)
+
+
+class PromptTemplate:
+    """
+    A system prompt split into a static prefix and a small per-request context.
+
+    The prefix never changes between requests, so it can sit behind a Bedrock
+    cache checkpoint once it reaches CACHE_MIN_TOKENS; the context (location,
+    weather, ...) is appended after it.
+    """
+
+    def __init__(self, static_text, context_template=""):
+        self.static_text = static_text
+        self.context_template = context_template
+        self.cacheable = estimate_tokens(static_text) >= CACHE_MIN_TOKENS
+
+    def context(self, **values):
+        return self.context_template.format(**values).strip() if self.context_template else ""
+
+    def converse_system(self, cache=False, **values):
+        """
+        Returns the `system` argument for `converse` / `converse_stream`. With
+        `cache` a checkpoint follows the prefix, unless it is too short to be cached.
+        """
+        blocks = [{"text": self.static_text}]
+        if cache and self.cacheable:
+            blocks.append({"cachePoint": {"type": "default"}})
+        context = self.context(**values)
+        if context:
+            blocks.append({"text": context})
+        return blocks
+
+
+@functools.lru_cache(maxsize=None)
+def load_template(name):
+    """
+    Loads `templates/<name>.txt` once and returns it as a PromptTemplate.
+    """
+    with open(os.path.join(TEMPLATE_DIR, name + ".txt"), encoding="utf-8") as f:
+        text = f.read()
+    static_text, _, context_template = text.partition(CONTEXT_MARKER)
+    return PromptTemplate(static_text.strip(), context_template.strip())
@@ -0,0 +1,224 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Async token bucket holding callers to `per_minute` calls.
+
+    Up to `burst` calls may go out back to back after an idle spell; after that
+    callers are released one at a time, in arrival order, as tokens refill.
+    `per_minute=0` disables the limit.
+    """
+
+    def __init__(self, per_minute, burst=None):
+        self.per_minute = per_minute
+        self.capacity = burst or max(1.0, per_minute / 6)
+        self._tokens = self.capacity
+        self._refilled_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.acquired = 0
+        self.waited_seconds = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._refilled_at) * self.per_minute / 60)
+        self._refilled_at = now
+
+    async def acquire(self):
+        """
+        Waits until a call may be made.
+        """
+        if self.per_minute <= 0:
+            return
+        started = time.monotonic()
+        # The lock queues waiters in arrival order
+        async with self._lock:
+            while True:
+                self._refill(time.monotonic())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) * 60 / self.per_minute)
+        self.acquired += 1
+        self.waited_seconds += time.monotonic() - started
+
+    def stats(self):
+        return {
+            "per_minute": self.per_minute,
+            "acquired": self.acquired,
+            "waited_seconds": round(self.waited_seconds, 3),
+        }
+
+
+# Request priorities; lower numbers are sent first when a model is rate limited
+INTERACTIVE = 0
+BATCH = 1
+
+_priority = contextvars.ContextVar("farmwise_priority", default=INTERACTIVE)
+
+
+@contextlib.contextmanager
+def request_priority(priority):
+    """
+    Sends the model calls made inside the block (including on worker threads
+    started from it by ModelInvoker) at `priority`.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+def at_priority(priority, func, *args, **kwargs):
+    """
+    Calls `func(*args, **kwargs)` at `priority`; handy for run_in_executor.
+    """
+    with request_priority(priority):
+        return func(*args, **kwargs)
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe token bucket whose rate follows the provider's throttling (AIMD).
+
+    With no `per_minute` calls go out unlimited until the first throttle,
+    which sets the rate to `decrease` times the rate actually sent over the
+    last `window` seconds. After that, while callers are being held back,
+    successful calls raise the rate each second by `increase` times the rate
+    set at the last decrease (additive within each cycle, so the default
+    climbs back from a halving in about ten seconds), and a throttle
+    multiplies it by `decrease` once throttles make up more than `tolerance`
+    of the calls sent in the last `window` seconds (sporadic throttles are
+    left to the caller's retry). Throttles on calls admitted before the last
+    decrease only report the old rate and are ignored, so a burst of them
+    counts as one signal (one decrease per round trip, as in TCP).
+    Waiting callers are served lowest priority number first, then in arrival order.
+    """
+
+    def __init__(self, per_minute=None, min_per_minute=6, max_per_minute=None, increase=0.1, decrease=0.5,
+                 tolerance=0.1, window=10.0):
+        self.per_minute = float(per_minute) if per_minute else None
+        self._step = max(self.per_minute or 0, 60) * increase
+        self.min_per_minute = min_per_minute
+        self.max_per_minute = max_per_minute or float("inf")
+        self.increase = increase
+        self.decrease = decrease
+        self.tolerance = tolerance
+        self.window = window
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = itertools.count()
+        self._sent = deque()
+        self._throttled = deque()
+        now = time.monotonic()
+        self._tokens = 1.0
+        self._refilled_at = now
+        self._limited_at = float("-inf")
+        self._increased_at = now
+        self._decreased_at = float("-inf")
+        self.acquired = 0
+        self.throttles = 0
+
+    def _refill(self, now):
+        capacity = max(1.0, self.per_minute / 60)
+        self._tokens = min(capacity, self._tokens + (now - self._refilled_at) * self.per_minute / 60)
+        self._refilled_at = now
+
+    def _expire(self, times, now):
+        while times and times[0] <= now - self.window:
+            times.popleft()
+
+    def _record_send(self, now):
+        self.acquired += 1
+        self._sent.append(now)
+        self._expire(self._sent, now)
+
+    def acquire(self, priority=INTERACTIVE):
+        """
+        Blocks until this caller may send; returns the seconds it waited.
+        """
+        started = time.monotonic()
+        with self._condition:
+            if self.per_minute is None:
+                self._record_send(started)
+                return 0.0
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._queue, ticket)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    at_head = self._queue[0] == ticket
+                    if at_head and self._tokens >= 1:
+                        break
+                    self._limited_at = now
+                    # Only the head of the queue sleeps until the next token; the rest wait for their turn
+                    self._condition.wait((1 - self._tokens) * 60 / self.per_minute if at_head else None)
+            except BaseException:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._queue)
+            self._tokens -= 1
+            self._record_send(now)
+            self._condition.notify_all()
+        return time.monotonic() - started
+
+    def on_success(self):
+        with self._condition:
+            now = time.monotonic()
+            if self.per_minute is not None and now - self._limited_at < 1:
+                # Demand is above the current rate, so probe upwards
+                elapsed = min(1.0, now - self._increased_at)
+                self.per_minute = min(self.max_per_minute, self.per_minute + self._step * elapsed)
+            self._increased_at = now
+
+    def on_throttle(self, admitted_at=None):
+        """
+        Records a throttled call; `admitted_at` is the monotonic time acquire() let it through.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.throttles += 1
+            self._throttled.append(now)
+            self._expire(self._throttled, now)
+            self._expire(self._sent, now)
+            if admitted_at is not None and admitted_at < self._decreased_at:
+                return
+            # The extra one keeps a couple of unlucky throttles among a few calls from counting as overload
+            if len(self._throttled) <= self.tolerance * len(self._sent) + 1:
+                return
+            if self.per_minute is None:
+                # Measure over the time actually spent sending, which may be less than the window
+                span = max(1.0, now - self._sent[0]) if self._sent else self.window
+                self.per_minute = max(self.min_per_minute, len(self._sent) * 60 / span * self.decrease)
+                self._refilled_at = now
+            else:
+                self.per_minute = max(self.min_per_minute, self.per_minute * self.decrease)
+            # Never climb slower than `increase` of one request per second, however low the rate fell
+            self._step = max(self.per_minute, 60) * self.increase
+            self._decreased_at = now
+            # Spend the burst allowance too, so the lower rate takes effect immediately
+            self._tokens = min(self._tokens, 0.0)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "per_minute": None if self.per_minute is None else round(self.per_minute, 1),
+                "waiting": len(self._queue),
+                "acquired": self.acquired,
+                "throttles": self.throttles,
+            }
@@ -0,0 +1,160 @@
+import math
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Words that carry no meaning for matching farmers' questions
+STOP_WORDS = {
+    "a", "an", "and", "are", "can", "do", "does", "for", "how", "i", "in", "is", "it",
+    "me", "my", "of", "on", "or", "should", "so", "the", "to", "what", "when", "which",
+    "why", "with", "you", "your",
+}
+
+EMBEDDING_DIMENSIONS = 512
+
+
+def normalize_prompt(text):
+    """
+    Lowercases the prompt and collapses punctuation and whitespace.
+    """
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def hashed_embedding(text):
+    """
+    Embeds text as a sparse, L2-normalized vector of hashed unigrams and bigrams.
+
+    This is a dependency-free stand-in for a sentence-embedding model; it only
+    catches rewordings that keep the same key words, which is what repeated
+    farmer questions mostly are.
+    """
+    words = [w for w in normalize_prompt(text).split() if w not in STOP_WORDS]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    vector = {}
+    for feature in features:
+        index = zlib.crc32(feature.encode()) % EMBEDDING_DIMENSIONS
+        vector[index] = vector.get(index, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    return {i: v / norm for i, v in vector.items()} if norm else {}
+
+
+def _cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(i, 0.0) for i, v in a.items())
+
+
+def weather_bucket(temperature=None, humidity=None, wind_speed=None):
+    """
+    Coarsens weather readings so answers can be shared across similar conditions.
+    """
+    if temperature is None:
+        return None
+    return (
+        5 * round(float(temperature) / 5),
+        None if humidity is None else 20 * round(float(humidity) / 20),
+        None if wind_speed is None else 5 * round(float(wind_speed) / 5),
+    )
+
+
+def wants_fresh(headers):
+    """
+    Returns True when the client sent `Cache-Control: no-cache`.
+    """
+    return "no-cache" in (headers.get("Cache-Control") or "").lower()
+
+
+class ResponseCache:
+    """
+    Caches model answers by normalized prompt and a coarse context (location
+    cell and weather bucket).
+
+    Lookups try an exact match first. With `semantic=True` they then fall back
+    to the most similar cached prompt in the same context whose cosine
+    similarity is at least `similarity`.
+    """
+
+    def __init__(self, ttl=3600, max_entries=2048, semantic=False, similarity=0.9, embed=hashed_embedding):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.similarity = similarity
+        self.embed = embed
+        self._entries = OrderedDict()
+        self._by_context = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, prompt, context):
+        """
+        Returns the cached response for the prompt in this context, or None.
+        """
+        normalized = normalize_prompt(prompt)
+        now = time.monotonic()
+        with self._lock:
+            key = (normalized, context)
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry["expires_at"] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry["response"]
+                del self._entries[key]
+                self._discard(key)
+
+            if self.semantic:
+                vector = self.embed(normalized)
+                best_key, best_score = None, self.similarity
+                for candidate in self._by_context.get(context, ()):
+                    candidate_entry = self._entries[candidate]
+                    if candidate_entry["expires_at"] <= now:
+                        continue
+                    score = _cosine(vector, candidate_entry["vector"])
+                    if score >= best_score:
+                        best_key, best_score = candidate, score
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    return self._entries[best_key]["response"]
+
+            self.misses += 1
+            return None
+
+    def put(self, prompt, context, response):
+        normalized = normalize_prompt(prompt)
+        key = (normalized, context)
+        with self._lock:
+            self._entries[key] = {
+                "expires_at": time.monotonic() + self.ttl,
+                "response": response,
+                "vector": self.embed(normalized) if self.semantic else None,
+            }
+            self._entries.move_to_end(key)
+            self._by_context.setdefault(context, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, _ = self._entries.popitem(last=False)
+                self._discard(old_key)
+                self.evictions += 1
+
+    def _discard(self, key):
+        keys = self._by_context.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_context[key[1]]
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "size": size,
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,294 @@
+import argparse
+import array
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import sys
+import tempfile
+
+from farmwise.response_cache import STOP_WORDS
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Agronomy guides and worked examples the index is built from; files under examples/ are examples
+CORPUS_DIR = os.path.join(DATA_DIR, "agronomy")
+
+# Built index, regenerated with `python -m farmwise.retrieval build`
+INDEX_DIR = os.path.join(DATA_DIR, ".cache", "agronomy-index")
+
+# Standard BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Passages scoring below this share only a common word or two with the prompt and are left out
+MIN_SCORE = 2.0
+
+# Postings are (passage id, term frequency) pairs of native unsigned ints
+_POSTING_TYPE = "I"
+
+
+def tokenize(text):
+    """
+    Lowercased words without stop words or single letters, with plural "s" stripped so "leaves" and "leave" match.
+    """
+    terms = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(word) < 2 or word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def _passages(path, kind, passage_words):
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    title, _, body = text.partition("\n")
+    title = title.lstrip("# ").strip()
+    if kind == "example":
+        yield title, body.strip()
+        return
+    # Guides are split on paragraphs, packed up to passage_words so each passage stands on its own
+    chunk = []
+    for paragraph in re.split(r"\n\s*\n", body.strip()):
+        if chunk and len(" ".join(chunk).split()) + len(paragraph.split()) > passage_words:
+            yield title, "\n\n".join(chunk)
+            chunk = []
+        chunk.append(paragraph.strip())
+    if chunk:
+        yield title, "\n\n".join(chunk)
+
+
+def _corpus_files(corpus_dir):
+    for root, _, files in sorted(os.walk(corpus_dir)):
+        for name in sorted(files):
+            if name.endswith((".md", ".txt")):
+                yield os.path.join(root, name)
+
+
+def corpus_fingerprint(corpus_dir=CORPUS_DIR):
+    """
+    Returns a hash of every document's path and contents, stored in the index to tell when it is out of date.
+    """
+    digest = hashlib.sha256()
+    for path in _corpus_files(corpus_dir):
+        digest.update(os.path.relpath(path, corpus_dir).encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def build_index(corpus_dir=CORPUS_DIR, index_dir=INDEX_DIR, passage_words=120):
+    """
+    Builds a BM25 index of every .md/.txt file under `corpus_dir` into `index_dir`.
+
+    The index is three files: `passages.bin` (UTF-8 passage text),
+    `postings.bin` (a flat array of passage ids and term counts per term) and
+    `meta.json` (vocabulary offsets, passage offsets and lengths, and the
+    corpus fingerprint). The first two are memory-mapped at query time. The
+    directory is replaced atomically.
+    """
+    passages = []
+    for path in _corpus_files(corpus_dir):
+        kind = "example" if os.path.basename(os.path.dirname(path)) == "examples" else "passage"
+        for title, text in _passages(path, kind, passage_words):
+            passages.append((kind, os.path.relpath(path, corpus_dir), title, text))
+
+    postings = {}
+    lengths = []
+    for passage_id, (_, _, title, text) in enumerate(passages):
+        counts = {}
+        terms = tokenize(f"{title} {text}")
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            postings.setdefault(term, []).extend((passage_id, count))
+        lengths.append(len(terms))
+
+    parent = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(parent, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=parent, prefix=".index-")
+    vocabulary = {}
+    flat = array.array(_POSTING_TYPE)
+    for term in sorted(postings):
+        vocabulary[term] = [len(flat), len(postings[term]) // 2]
+        flat.extend(postings[term])
+    with open(os.path.join(build_dir, "postings.bin"), "wb") as f:
+        flat.tofile(f)
+
+    offsets = []
+    with open(os.path.join(build_dir, "passages.bin"), "wb") as f:
+        for kind, source, title, text in passages:
+            encoded = text.encode("utf-8")
+            offsets.append([f.tell(), len(encoded), kind, source, title])
+            f.write(encoded)
+
+    with open(os.path.join(build_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "byteorder": sys.byteorder,
+            "itemsize": flat.itemsize,
+            "vocabulary": vocabulary,
+            "passages": offsets,
+            "lengths": lengths,
+            "corpus": corpus_fingerprint(corpus_dir),
+        }, f)
+
+    if os.path.exists(index_dir):
+        old_dir = tempfile.mkdtemp(dir=parent, prefix=".index-old-")
+        os.replace(index_dir, os.path.join(old_dir, "index"))
+        os.replace(build_dir, index_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        try:
+            os.replace(build_dir, index_dir)
+        except OSError:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+    return len(passages)
+
+
+def _map(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class KnowledgeIndex:
+    """
+    Read-only BM25 index over agronomy passages and worked examples.
+
+    Postings and passage text stay memory-mapped, so every worker process
+    shares one copy through the page cache and only the vocabulary is loaded.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR):
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["byteorder"] != sys.byteorder or meta["itemsize"] != array.array(_POSTING_TYPE).itemsize:
+            raise ValueError(f"{index_dir} was built on a different platform; rebuild it")
+        self._vocabulary = meta["vocabulary"]
+        self._passages = meta["passages"]
+        self._lengths = meta["lengths"]
+        self._average_length = sum(self._lengths) / len(self._lengths) if self._lengths else 0
+        self._text = _map(os.path.join(index_dir, "passages.bin"))
+        postings = _map(os.path.join(index_dir, "postings.bin"))
+        self._postings = memoryview(postings).cast(_POSTING_TYPE) if len(postings) else []
+        self.searches = 0
+
+    def _score(self, query):
+        scores = {}
+        count = len(self._lengths)
+        for term in set(tokenize(query)):
+            entry = self._vocabulary.get(term)
+            if entry is None:
+                continue
+            start, frequency = entry
+            idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+            for i in range(start, start + 2 * frequency, 2):
+                passage_id, tf = self._postings[i], self._postings[i + 1]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[passage_id] / self._average_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def passage(self, passage_id):
+        offset, length, kind, source, title = self._passages[passage_id]
+        return {
+            "kind": kind,
+            "source": source,
+            "title": title,
+            "text": bytes(self._text[offset:offset + length]).decode("utf-8"),
+        }
+
+    def search(self, query, k=3, kind="passage", per_source=2, min_score=MIN_SCORE):
+        """
+        Returns up to `k` passages of `kind` that best match `query`, best first,
+        taking at most `per_source` from any one document.
+        """
+        self.searches += 1
+        scores = self._score(query)
+        ranked = sorted(
+            ((score, passage_id) for passage_id, score in scores.items()
+             if score >= min_score and self._passages[passage_id][2] == kind),
+            reverse=True,
+        )
+        results, taken = [], {}
+        for score, passage_id in ranked:
+            source = self._passages[passage_id][3]
+            if taken.get(source, 0) >= per_source:
+                continue
+            taken[source] = taken.get(source, 0) + 1
+            results.append({**self.passage(passage_id), "score": round(score, 3)})
+            if len(results) == k:
+                break
+        return results
+
+    def references(self, query, passages=3, examples=1):
+        """
+        Returns the reference material for a prompt: the best-matching guide
+        passages and worked examples as text, or "" when nothing matches.
+        """
+        sections = [f"{hit['title']}:\n{hit['text']}" for hit in self.search(query, passages)]
+        sections += [f"Example - {hit['title']}:\n{hit['text']}" for hit in self.search(query, examples, "example")]
+        return "\n\n".join(sections)
+
+    def stats(self):
+        return {
+            "passages": len(self._passages),
+            "terms": len(self._vocabulary),
+            "searches": self.searches,
+        }
+
+
+def _built_from(index_dir):
+    try:
+        with open(os.path.join(index_dir, "meta.json"), encoding="utf-8") as f:
+            return json.load(f).get("corpus")
+    except (OSError, ValueError):
+        return None
+
+
+def open_index(index_dir=INDEX_DIR, corpus_dir=CORPUS_DIR):
+    """
+    Opens the index, (re)building it from `corpus_dir` first if it has not
+    been built yet or the corpus has changed since it was.
+    """
+    meta_path = os.path.join(index_dir, "meta.json")
+    # A prebuilt index shipped without its corpus is used as-is
+    fingerprint = corpus_fingerprint(corpus_dir) if os.path.isdir(corpus_dir) else None
+    if not os.path.exists(meta_path) or (fingerprint and _built_from(index_dir) != fingerprint):
+        try:
+            build_index(corpus_dir, index_dir)
+        except OSError:
+            # Another worker process finished building it first
+            if not os.path.exists(meta_path):
+                raise
+    return KnowledgeIndex(index_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the agronomy retrieval index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a folder of .md/.txt documents")
+    build.add_argument("corpus", nargs="?", default=CORPUS_DIR)
+    build.add_argument("index", nargs="?", default=INDEX_DIR)
+    build.add_argument("--passage-words", type=int, default=120)
+    query = commands.add_parser("query", help="show the passages a prompt would retrieve")
+    query.add_argument("text")
+    query.add_argument("--index", default=INDEX_DIR)
+    query.add_argument("-k", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        count = build_index(args.corpus, args.index, args.passage_words)
+        print(f"Indexed {count} passages into {args.index}")
+    else:
+        index = KnowledgeIndex(args.index)
+        for kind in ("passage", "example"):
+            for hit in index.search(args.text, args.k, kind):
+                print(f"[{hit['score']}] {kind} {hit['source']} - {hit['title']}")
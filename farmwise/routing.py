@@ -0,0 +1,205 @@
+import re
+import threading
+import time
+from collections import deque
+
+SONNET_3_5 = "anthropic.claude-3-5-sonnet-20240620-v1:0"
+SONNET_3 = "anthropic.claude-3-sonnet-20240229-v1:0"
+HAIKU_3 = "anthropic.claude-3-haiku-20240307-v1:0"
+
+# Candidate models per request class, cheapest/fastest adequate model first
+DEFAULT_ROUTES = {
+    "short": [HAIKU_3, SONNET_3_5],
+    "diagnostic": [SONNET_3_5, SONNET_3, HAIKU_3],
+    "image": [SONNET_3_5, HAIKU_3],
+}
+
+# p95 latency (ms) above which a model is tried after the other candidates
+DEFAULT_LATENCY_BUDGETS = {"short": 4000, "diagnostic": 15000, "image": 20000}
+
+# Errors that mean "try another model" rather than "the request is bad"
+FAILOVER_ERRORS = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "InternalServerException",
+}
+
+DIAGNOSTIC_WORDS = re.compile(
+    r"\b(disease|diseased|spots?|yellow\w*|wilt\w*|blight|rot|mold|mildew|fungus|fungal|pests?|insects?|"
+    r"bugs?|treat\w*|diagnos\w*|symptoms?|dying|dead|curl\w*|lesions?|why)\b",
+    re.IGNORECASE,
+)
+
+
+def classify(prompt, has_image=False):
+    """
+    Buckets a request as "image", "diagnostic" or "short".
+    """
+    if has_image:
+        return "image"
+    if DIAGNOSTIC_WORDS.search(prompt) or len(prompt.split()) > 40:
+        return "diagnostic"
+    return "short"
+
+
+def error_code(exc):
+    return getattr(exc, "response", {}).get("Error", {}).get("Code")
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _service_ms(result):
+    return result.latency_ms if result.service_ms is None else result.service_ms
+
+
+class ModelRouter:
+    """
+    Picks a model for each request class and fails over between candidates.
+
+    Keeps a rolling window of latencies and outcomes per model, dropping
+    samples older than `max_age` seconds. A model is skipped while it is
+    cooling down after a throttle, and moved to the back of the list once it
+    has `min_samples` recent samples and its error rate or p95 latency is
+    over budget. A degraded model is still tried first by one request every
+    `probe_interval` seconds, so its samples stay fresh and it can recover.
+    """
+
+    def __init__(self, routes=None, latency_budgets=None, window=200, max_error_rate=0.2, cooldown=30, enabled=True,
+                 min_samples=20, max_age=120, probe_interval=10):
+        self.routes = routes or DEFAULT_ROUTES
+        self.latency_budgets = latency_budgets or DEFAULT_LATENCY_BUDGETS
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self.enabled = enabled
+        self.min_samples = min_samples
+        self.max_age = max_age
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._outcomes = {}
+        self._cooling_until = {}
+        self._probed_at = {}
+        self.failovers = 0
+        self.probes = 0
+
+    def _recent(self, samples, now):
+        """
+        Drops samples older than `max_age` and returns the values of the rest.
+        """
+        if samples is None:
+            return []
+        while samples and samples[0][0] < now - self.max_age:
+            samples.popleft()
+        return [value for _, value in samples]
+
+    def _healthy(self, model_id, budget, now):
+        if self._cooling_until.get(model_id, 0) > now:
+            return None
+        outcomes = self._recent(self._outcomes.get(model_id), now)
+        if len(outcomes) >= self.min_samples and outcomes.count(False) / len(outcomes) > self.max_error_rate:
+            return False
+        latencies = self._recent(self._latencies.get(model_id), now)
+        if len(latencies) >= self.min_samples and _percentile(latencies, 0.95) > budget:
+            return False
+        return True
+
+    def candidates(self, task, default_model):
+        """
+        Returns the models to try for `task`, best first.
+        """
+        if not self.enabled:
+            return [default_model]
+        route = self.routes.get(task, [default_model])
+        budget = self.latency_budgets.get(task, float("inf"))
+        now = time.monotonic()
+        with self._lock:
+            health = {model_id: self._healthy(model_id, budget, now) for model_id in route}
+            preferred = [m for m in route if health[m] is True]
+            degraded = [m for m in route if health[m] is False]
+            cooling = [m for m in route if health[m] is None]
+            for model_id in degraded:
+                if now - self._probed_at.get(model_id, float("-inf")) >= self.probe_interval:
+                    # Half-open trial: this request checks whether the model has recovered
+                    self._probed_at[model_id] = now
+                    self.probes += 1
+                    degraded.remove(model_id)
+                    preferred.insert(0, model_id)
+                    break
+        # Cooling models stay as a last resort so a request is never left without a model
+        return preferred + degraded + cooling
+
+    def record(self, model_id, latency_ms=None, error=None):
+        """
+        Records one call; `latency_ms` should be the model's service time, not time spent queueing for it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            outcomes = self._outcomes.setdefault(model_id, deque(maxlen=self.window))
+            outcomes.append((now, error is None))
+            if latency_ms is not None and error is None:
+                self._latencies.setdefault(model_id, deque(maxlen=self.window)).append((now, latency_ms))
+            if error is not None and error_code(error) == "ThrottlingException":
+                self._cooling_until[model_id] = now + self.cooldown
+
+    def call(self, task, default_model, invoke):
+        """
+        Calls `invoke(model_id)` (which returns a ModelResult) on the best
+        candidate, failing over to the next one on throttling or outages.
+        """
+        candidates = self.candidates(task, default_model)
+        for attempt, model_id in enumerate(candidates):
+            try:
+                result = invoke(model_id)
+            except Exception as exc:
+                self.record(model_id, error=exc)
+                if error_code(exc) not in FAILOVER_ERRORS or attempt == len(candidates) - 1:
+                    raise
+                self.failovers += 1
+                continue
+            self.record(model_id, _service_ms(result))
+            return result
+
+    def stream(self, task, default_model, open_stream):
+        """
+        Streaming counterpart of `call`. `open_stream(model_id)` returns a
+        ModelStream; failover is only possible before the first chunk is sent.
+        Returns (as the generator's value) the finished stream's ModelResult.
+        """
+        candidates = self.candidates(task, default_model)
+        for attempt, model_id in enumerate(candidates):
+            stream = open_stream(model_id)
+            started = False
+            try:
+                for text in stream:
+                    started = True
+                    yield text
+            except Exception as exc:
+                self.record(model_id, error=exc)
+                if started or error_code(exc) not in FAILOVER_ERRORS or attempt == len(candidates) - 1:
+                    raise
+                self.failovers += 1
+                continue
+            self.record(model_id, _service_ms(stream.result) if stream.result else None)
+            return stream.result
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            models = {}
+            for model_id, samples in self._outcomes.items():
+                outcomes = self._recent(samples, now)
+                latencies = self._recent(self._latencies.get(model_id), now)
+                models[model_id] = {
+                    "p50_ms": _percentile(latencies, 0.5) if latencies else None,
+                    "p95_ms": _percentile(latencies, 0.95) if latencies else None,
+                    "error_rate": outcomes.count(False) / len(outcomes) if outcomes else None,
+                    "samples": len(outcomes),
+                    "cooling_down": self._cooling_until.get(model_id, 0) > now,
+                }
+        return {"enabled": self.enabled, "failovers": self.failovers, "probes": self.probes, "models": models}
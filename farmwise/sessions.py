@@ -0,0 +1,231 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from farmwise.logs import log_event
+
+# Model that writes the rolling conversation summaries
+SUMMARY_MODEL = "meta.llama3-1-70b-instruct-v1:0"
+
+SUMMARY_INSTRUCTIONS = "You are an app that creates summaries of text in 50 words or less."
+
+
+def estimate_tokens(text):
+    """
+    Rough token count (about four characters per token), good enough for budgeting.
+    """
+    return len(text) // 4 + 1
+
+
+def _new_state():
+    return {"summary": "", "turns": []}
+
+
+class MemorySessionStore:
+    """
+    In-process LRU of session states; sessions idle for `ttl` seconds expire.
+    """
+
+    def __init__(self, max_sessions=10000, ttl=24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            if entry[0] + self.ttl <= time.monotonic():
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return json.loads(entry[1])
+
+    def save(self, session_id, state):
+        with self._lock:
+            self._sessions[session_id] = (time.monotonic(), json.dumps(state))
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Session states in a SQLite file, so conversations survive restarts and are
+    shared by worker processes on the same host.
+    """
+
+    def __init__(self, path, max_sessions=100000, ttl=7 * 24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, state TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM sessions WHERE id = ? AND updated > ?", (session_id, time.time() - self.ttl)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session_id, state):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)",
+                (session_id, json.dumps(state), time.time()),
+            )
+            self._writes += 1
+            # Pruning scans the index, so only do it every few hundred writes
+            if self._writes % 500 == 0:
+                self._db.execute("DELETE FROM sessions WHERE updated <= ?", (time.time() - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM sessions WHERE id IN "
+                    "(SELECT id FROM sessions ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                    (self.max_sessions,),
+                )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class ConversationMemory:
+    """
+    Keeps each session's recent turns verbatim and folds older ones into a
+    rolling summary, so a follow-up's prompt stays under `token_budget`.
+
+    The newest `keep_turns` exchanges are never summarized. `summarize(text)`
+    is a blocking model call and runs in `record`, after the answer was sent.
+    """
+
+    def __init__(self, store, summarize, token_budget=1500, keep_turns=2):
+        self.store = store
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.keep_turns = keep_turns
+        self._lock = threading.Lock()
+        self._compacting = set()
+        self.compactions = 0
+        self.summary_failures = 0
+
+    def _size(self, state):
+        return estimate_tokens(state["summary"]) + sum(estimate_tokens(turn["text"]) for turn in state["turns"])
+
+    def context(self, session_id):
+        """
+        Returns `(summary, messages)` for the session: the rolling summary (may
+        be empty) and the earlier turns as Converse messages, newest last.
+
+        If a compaction is still pending, the oldest exchanges are left out so
+        the history never exceeds the budget.
+        """
+        state = self.store.load(session_id) or _new_state()
+        turns = state["turns"]
+        budget = self.token_budget - estimate_tokens(state["summary"])
+        start = len(turns)
+        # Walk back one exchange (user + assistant) at a time so the history starts with a user turn
+        while start >= 2:
+            cost = sum(estimate_tokens(turn["text"]) for turn in turns[start - 2:start])
+            if cost > budget:
+                break
+            budget -= cost
+            start -= 2
+        messages = [{"role": turn["role"], "content": [{"text": turn["text"]}]} for turn in turns[start:]]
+        return state["summary"], messages
+
+    def record(self, session_id, user_text, assistant_text):
+        """
+        Appends one exchange to the session and compacts it if it is over budget.
+        """
+        with self._lock:
+            state = self.store.load(session_id) or _new_state()
+            state["turns"] += [{"role": "user", "text": user_text}, {"role": "assistant", "text": assistant_text}]
+            self.store.save(session_id, state)
+        self.compact(session_id)
+
+    def compact(self, session_id):
+        with self._lock:
+            state = self.store.load(session_id)
+            if (
+                state is None
+                or session_id in self._compacting
+                or self._size(state) <= self.token_budget
+                or len(state["turns"]) <= 2 * self.keep_turns
+            ):
+                return
+            folded = state["turns"][:len(state["turns"]) - 2 * self.keep_turns]
+            self._compacting.add(session_id)
+
+        transcript = "\n".join(f"{turn['role'].capitalize()}: {turn['text']}" for turn in folded)
+        if state["summary"]:
+            transcript = f"Earlier summary: {state['summary']}\n{transcript}"
+        try:
+            summary = self.summarize(transcript)
+        except Exception as exc:
+            # Without a summary the oldest turns are simply dropped; the budget still holds
+            self.summary_failures += 1
+            log_event("session_summary_failed", level=logging.WARNING, error=repr(exc))
+            summary = state["summary"]
+
+        with self._lock:
+            self._compacting.discard(session_id)
+            state = self.store.load(session_id) or _new_state()
+            # Only appends can have happened meanwhile, so the folded turns are still at the front
+            state["turns"] = state["turns"][len(folded):]
+            state["summary"] = summary.strip()
+            self.store.save(session_id, state)
+            self.compactions += 1
+
+    def stats(self):
+        return {
+            "sessions": len(self.store),
+            "compactions": self.compactions,
+            "summary_failures": self.summary_failures,
+        }
+
+
+def make_summarizer(gateway, model_id=SUMMARY_MODEL):
+    """
+    Returns a `summarize(text)` for ConversationMemory that calls `model_id`
+    through the app's BedrockGateway, so summaries share its slots and rate limits.
+    """
+    system = [{"text": SUMMARY_INSTRUCTIONS}]
+
+    def summarize(text):
+        messages = [{"role": "user", "content": [{"text": f"Summarize the following text: {text}."}]}]
+        return gateway.converse(model_id, messages, system=system, inference_config={"temperature": 0.5}).text
+
+    return summarize
+
+
+def with_summary(system, summary):
+    """
+    Appends the conversation summary to a system prompt, after any cache point
+    so the cached prefix is unchanged.
+    """
+    if not summary:
+        return system
+    return system + [{"text": f"Summary of the earlier conversation with this farmer: {summary}"}]
+
+
+def make_session_store(db_path=None, max_sessions=10000, ttl=24 * 3600):
+    """
+    Returns a SQLite store when `db_path` is set, else an in-process one.
+    """
+    if db_path:
+        return SQLiteSessionStore(db_path, max_sessions=max_sessions, ttl=ttl)
+    return MemorySessionStore(max_sessions=max_sessions, ttl=ttl)
@@ -0,0 +1,115 @@
+import asyncio
+
+
+class _Flight:
+    """
+    One in-flight generation: the chunks produced so far, and whether (and how) it ended.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.task = None
+        self._changed = asyncio.Event()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def push(self, chunk):
+        self.chunks.append(chunk)
+        self._wake()
+
+    def finish(self, error=None):
+        self.done = True
+        self.error = error
+        self._wake()
+
+
+class SingleFlight:
+    """
+    Shares one in-flight generation between identical concurrent requests.
+
+    The first request for a key starts the generation in a background task;
+    requests arriving while it runs replay the chunks produced so far and then
+    follow along, so streams and plain calls can join the same flight. The
+    generation is cancelled once every request following it has gone away.
+    `coalesced` counts the model calls saved.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key, open_stream, on_complete):
+        flight = self._flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight
+        flight = self._flights[key] = _Flight()
+        flight.task = asyncio.create_task(self._lead(key, flight, open_stream, on_complete))
+        self.leaders += 1
+        return flight
+
+    async def _lead(self, key, flight, open_stream, on_complete):
+        error = None
+        try:
+            async for chunk in open_stream():
+                flight.push(chunk)
+            if on_complete is not None:
+                on_complete("".join(flight.chunks))
+        except Exception as exc:
+            error = exc
+        finally:
+            # Requests arriving from now on start a new flight (or hit whatever on_complete stored)
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.finish(error)
+
+    async def stream(self, key, open_stream, on_complete=None):
+        """
+        Yields the chunks of the generation for `key`, starting it with
+        `open_stream()` (an async iterator factory) unless one is already in
+        flight. `on_complete(text)` runs once when a generation succeeds.
+        """
+        flight = self._join(key, open_stream, on_complete)
+        flight.followers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(flight.chunks):
+                    index += 1
+                    yield flight.chunks[index - 1]
+                elif flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                else:
+                    await flight._changed.wait()
+        finally:
+            flight.followers -= 1
+            if flight.followers == 0 and not flight.done:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
+
+    async def run(self, key, call, on_complete=None):
+        """
+        Returns the text of the generation for `key`, starting it with the
+        coroutine function `call()` unless one is already in flight.
+        """
+
+        async def open_stream():
+            yield await call()
+
+        return "".join([chunk async for chunk in self.stream(key, open_stream, on_complete)])
+
+    def stats(self):
+        return {
+            "size": len(self._flights),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,11 @@
+import json
+
+
+def sse_event(data, event=None):
+    """
+    Formats one Server-Sent Events message with a JSON payload.
+    """
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from farmwise import http_clients, metrics
+from farmwise.logs import log_event
+
+# WMO weather interpretation codes reported by Open-Meteo, by range
+WMO_DESCRIPTIONS = (
+    (0, "Clear sky"), (3, "Partly cloudy"), (48, "Fog"), (57, "Drizzle"), (67, "Rain"),
+    (77, "Snow"), (82, "Rain showers"), (86, "Snow showers"), (99, "Thunderstorm"),
+)
+
+
+class WeatherUnavailable(Exception):
+    """
+    Raised when no provider could return current conditions.
+    """
+
+
+@dataclass(frozen=True)
+class Weather:
+    """
+    Current conditions in one schema, whichever provider reported them.
+    """
+
+    temperature_c: float
+    humidity: float
+    wind_kph: float | None
+    description: str | None
+    provider: str
+    observed_at: float
+
+    @property
+    def temperature_f(self):
+        return round(self.temperature_c * 9 / 5 + 32, 1)
+
+    @property
+    def wind_mph(self):
+        return None if self.wind_kph is None else round(self.wind_kph / 1.609, 1)
+
+    def age_note(self, fresh_for):
+        """
+        Returns a sentence saying how old the readings are, or "" while they are younger than `fresh_for` seconds.
+        """
+        age = time.time() - self.observed_at
+        return f" These readings are {round(age / 60)} minutes old." if age > fresh_for else ""
+
+
+def _malformed(provider, exc):
+    return WeatherUnavailable(f"{provider} returned a malformed response ({exc!r})")
+
+
+class WeatherProvider:
+    """
+    One upstream weather API. `fetch` returns a Weather or raises; providers
+    that can also look up a place by name say so in `can_serve`.
+    """
+
+    name = "provider"
+    host = None
+
+    def can_serve(self, lat, lon, query):
+        return lat is not None and lon is not None
+
+    async def _get(self, url, params):
+        # No retries here: a slow or failing provider is hedged or failed over instead
+        response = await http_clients.aget(url, params=params, retries=0)
+        if response.status_code != 200:
+            raise WeatherUnavailable(f"{self.name} returned HTTP {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as exc:
+            raise _malformed(self.name, exc)
+
+    async def fetch(self, lat=None, lon=None, query=None):
+        raise NotImplementedError
+
+
+class OpenWeatherMap(WeatherProvider):
+    name = "openweathermap"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def can_serve(self, lat, lon, query):
+        return super().can_serve(lat, lon, query) or bool(query)
+
+    async def fetch(self, lat=None, lon=None, query=None):
+        params = {"appid": self.api_key, "units": "metric"}
+        params.update({"lat": lat, "lon": lon} if lat is not None and lon is not None else {"q": query})
+        data = await self._get("https://api.openweathermap.org/data/2.5/weather", params)
+        try:
+            return Weather(
+                temperature_c=float(data["main"]["temp"]),
+                humidity=float(data["main"]["humidity"]),
+                # Metric units report wind in m/s
+                wind_kph=round(float(data["wind"]["speed"]) * 3.6, 1) if "wind" in data else None,
+                description=(data.get("weather") or [{}])[0].get("description"),
+                provider=self.name,
+                observed_at=time.time(),
+            )
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as exc:
+            raise _malformed(self.name, exc)
+
+
+class Weatherstack(WeatherProvider):
+    name = "weatherstack"
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def can_serve(self, lat, lon, query):
+        return super().can_serve(lat, lon, query) or bool(query)
+
+    async def fetch(self, lat=None, lon=None, query=None):
+        location = f"{lat},{lon}" if lat is not None and lon is not None else query
+        data = await self._get("http://api.weatherstack.com/current", {"access_key": self.api_key, "query": location})
+        try:
+            current = data["current"]
+            return Weather(
+                temperature_c=float(current["temperature"]),
+                humidity=float(current["humidity"]),
+                wind_kph=float(current["wind_speed"]) if current.get("wind_speed") is not None else None,
+                description=(current.get("weather_descriptions") or [None])[0],
+                provider=self.name,
+                observed_at=time.time(),
+            )
+        except (KeyError, IndexError, TypeError, ValueError) as exc:
+            # Errors (bad key, quota) come back as HTTP 200 with an "error" object instead of "current"
+            raise _malformed(self.name, data.get("error", exc) if isinstance(data, dict) else exc)
+
+
+class OpenMeteo(WeatherProvider):
+    """
+    Keyless, coordinates only.
+    """
+
+    name = "open-meteo"
+
+    async def fetch(self, lat=None, lon=None, query=None):
+        data = await self._get("https://api.open-meteo.com/v1/forecast", {
+            "latitude": lat,
+            "longitude": lon,
+            "current": "temperature_2m,relative_humidity_2m,wind_speed_10m,weather_code",
+        })
+        try:
+            current = data["current"]
+            code = current.get("weather_code")
+            return Weather(
+                temperature_c=float(current["temperature_2m"]),
+                humidity=float(current["relative_humidity_2m"]),
+                wind_kph=float(current["wind_speed_10m"]) if current.get("wind_speed_10m") is not None else None,
+                description=next((text for top, text in WMO_DESCRIPTIONS if code is not None and code <= top), None),
+                provider=self.name,
+                observed_at=time.time(),
+            )
+        except (KeyError, TypeError, ValueError) as exc:
+            raise _malformed(self.name, exc)
+
+
+def make_providers(names, openweathermap_key=None, weatherstack_key=None):
+    """
+    Builds providers from a comma-separated preference list such as
+    "openweathermap,open-meteo". Providers whose API key is missing are left out.
+    """
+    factories = {
+        "openweathermap": lambda: OpenWeatherMap(openweathermap_key) if openweathermap_key else None,
+        "weatherstack": lambda: Weatherstack(weatherstack_key) if weatherstack_key else None,
+        "open-meteo": OpenMeteo,
+    }
+    providers = []
+    for name in filter(None, (part.strip().lower() for part in names.split(","))):
+        if name not in factories:
+            raise ValueError(f"Unknown weather provider {name!r}")
+        provider = factories[name]()
+        if provider is not None:
+            providers.append(provider)
+    return providers
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after `failure_threshold` consecutive failures.
+
+    After `reset_after` seconds one trial call is let through; its success
+    closes the circuit again and its failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold=5, reset_after=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_after else "open"
+
+    def allow(self):
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self._trial = False
+
+
+class WeatherService:
+    """
+    Current weather from the first healthy provider, hedged and failed over.
+
+    Providers are tried in order. If the first has not answered within its
+    own p95 latency (`hedge_after` until it has `min_samples` of history,
+    never more than `max_hedge_after`), the next provider is asked as well
+    and whichever answers first wins; a provider that fails hands over to the
+    next one straight away. Each provider has a CircuitBreaker, so one that
+    is down is skipped instead of costing every request a timeout.
+    """
+
+    def __init__(self, providers, hedge_after=0.5, max_hedge_after=1.0, min_samples=20, window=200,
+                 failure_threshold=5, reset_after=30.0):
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self.max_hedge_after = max_hedge_after
+        self.min_samples = min_samples
+        self._latencies = {provider.name: deque(maxlen=window) for provider in self.providers}
+        self._breakers = {provider.name: CircuitBreaker(failure_threshold, reset_after) for provider in self.providers}
+        self._counts = {provider.name: {"calls": 0, "failures": 0, "wins": 0} for provider in self.providers}
+        self.hedges = 0
+        self.failovers = 0
+
+    def hedge_delay(self, name):
+        """
+        Seconds to wait on provider `name` before asking the next one too.
+        """
+        latencies = self._latencies[name]
+        if len(latencies) < self.min_samples:
+            return self.hedge_after
+        ordered = sorted(latencies)
+        return min(self.max_hedge_after, ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))])
+
+    async def _call(self, provider, lat, lon, query):
+        counts = self._counts[provider.name]
+        counts["calls"] += 1
+        started = time.perf_counter()
+        try:
+            with metrics.WEATHER_SECONDS.labels(provider.name).time():
+                weather = await provider.fetch(lat, lon, query)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            counts["failures"] += 1
+            self._breakers[provider.name].record_failure()
+            log_event("weather_provider_failed", level=logging.WARNING, provider=provider.name, error=repr(exc))
+            raise
+        self._latencies[provider.name].append(time.perf_counter() - started)
+        self._breakers[provider.name].record_success()
+        return weather
+
+    async def current(self, lat=None, lon=None, query=None):
+        """
+        Returns a Weather for the coordinates (or, for providers that support
+        it, the place name `query`). Raises WeatherUnavailable when every
+        provider that could answer fails or has its circuit open.
+        """
+        candidates = iter(
+            provider for provider in self.providers
+            if provider.can_serve(lat, lon, query) and self._breakers[provider.name].allow()
+        )
+        loop = asyncio.get_running_loop()
+        running = {}
+        errors = []
+        hedged = False
+        hedge_at = None
+
+        def launch():
+            nonlocal hedge_at
+            provider = next(candidates, None)
+            if provider is None:
+                return False
+            task = asyncio.ensure_future(self._call(provider, lat, lon, query))
+            # A loser is left to finish in the background so its latency and outcome are still recorded
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            running[task] = provider
+            hedge_at = loop.time() + self.hedge_delay(provider.name)
+            return True
+
+        if not launch():
+            raise WeatherUnavailable("No weather provider is available")
+        while True:
+            timeout = None if hedged else max(0.0, hedge_at - loop.time())
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # The request is slower than this provider's usual; ask the next one as well
+                hedged = True
+                if launch():
+                    self.hedges += 1
+                continue
+            for task in done:
+                provider = running.pop(task)
+                if task.exception() is None:
+                    self._counts[provider.name]["wins"] += 1
+                    return task.result()
+                errors.append(f"{provider.name}: {task.exception()}")
+            if not running:
+                if not launch():
+                    raise WeatherUnavailable("; ".join(errors))
+                self.failovers += 1
+
+    def stats(self):
+        return {
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+            "providers": {
+                name: {
+                    **counts,
+                    "hedge_after_ms": round(self.hedge_delay(name) * 1000),
+                    "circuit": self._breakers[name].state,
+                }
+                for name, counts in self._counts.items()
+            },
+        }
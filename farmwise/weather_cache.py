@@ -0,0 +1,179 @@
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def _is_present(value):
+    return value is not None
+
+
+class WeatherCache:
+    """
+    In-memory LRU cache for current-weather lookups with a fixed time to live.
+
+    Entries are keyed by a coarse geo cell (lat/lon rounded to `precision`
+    decimals, about 1 km at the default of 2) or by a normalized location
+    string, so nearby farms share one upstream call. Concurrent misses for the
+    same key are coalesced into a single fetch. Expired entries are kept for
+    another `stale_for` seconds and served if the fetch that should replace
+    them fails.
+    """
+
+    def __init__(self, ttl=600, max_entries=1024, precision=2, stale_for=0):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.stale_for = stale_for
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pending_threads = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale_served = 0
+
+    def key_for(self, lat=None, lon=None, location=None):
+        """
+        Returns the cache key for a coordinate pair or a free-text location.
+        """
+        if lat is not None and lon is not None:
+            try:
+                return ("geo", round(float(lat), self.precision), round(float(lon), self.precision))
+            except ValueError:
+                pass
+        if location:
+            return ("loc", re.sub(r"[\W_]+", " ", location.lower()).strip())
+        return ("raw", lat, lon)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                if expires_at + self.stale_for <= time.monotonic():
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def stale(self, key):
+        """
+        Returns the value for `key` even if it has expired (within `stale_for`), or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] + self.stale_for <= time.monotonic():
+                return None
+            if entry[0] <= time.monotonic():
+                self.stale_served += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def aget_or_fetch(self, key, fetch, cache_if=_is_present):
+        """
+        Returns the cached value for `key`, awaiting `fetch()` on a miss.
+
+        Only the first caller for a missing key runs `fetch`; the others await
+        its result. Values rejected by `cache_if` are returned but not stored.
+        If `fetch` fails, a stale value is returned in its place when there is one.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            value = await fetch()
+            if cache_if(value):
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            value = self.stale(key)
+            if value is not None:
+                future.set_result(value)
+                return value
+            future.set_exception(exc)
+            # Retrieve the exception so an unawaited future doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def get_or_fetch(self, key, fetch, cache_if=_is_present):
+        """
+        Blocking counterpart of `aget_or_fetch` for threaded servers.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            waiter = self._pending_threads.get(key)
+            if waiter is None:
+                waiter = self._pending_threads[key] = {"event": threading.Event()}
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            waiter["event"].wait()
+            if "error" in waiter:
+                raise waiter["error"]
+            return waiter["value"]
+
+        try:
+            value = fetch()
+            if cache_if(value):
+                self.put(key, value)
+            waiter["value"] = value
+            return value
+        except Exception as exc:
+            value = self.stale(key)
+            if value is not None:
+                waiter["value"] = value
+                return value
+            waiter["error"] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._pending_threads[key]
+            waiter["event"].set()
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "stale_served": self.stale_served,
+        }
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict
+
+from farmwise.logs import log_event
+from farmwise.weather_cache import _is_present
+
+
+class WeatherPrefetcher:
+    """
+    Keeps the weather cache warm for the farms that are actually asking.
+
+    Every request registers its location; a background task then refreshes
+    each registered location shortly before its cache entry would expire, at a
+    jittered interval so refreshes don't bunch up. Upstream calls are held to
+    `per_minute` by a token bucket, and locations not seen for `active_for`
+    seconds are dropped, as are the least recently seen beyond `max_locations`.
+    """
+
+    def __init__(self, cache, interval=None, jitter=0.15, per_minute=10, max_locations=500, active_for=24 * 3600):
+        self.cache = cache
+        # Refresh before the entry expires so readers never see a miss
+        self.interval = interval or cache.ttl * 0.8
+        self.jitter = jitter
+        self.per_minute = per_minute
+        self.max_locations = max_locations
+        self.active_for = active_for
+        self._locations = OrderedDict()
+        self._tokens = max(1.0, per_minute / 6)
+        self._refilled_at = time.monotonic()
+        self.refreshes = 0
+        self.failures = 0
+        self.deferred = 0
+
+    def _next_due(self, now):
+        return now + self.interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def register(self, key, fetch, cache_if=_is_present):
+        """
+        Marks `key` as active. `fetch()` returns an awaitable of fresh weather
+        and `cache_if` says whether a result is worth storing.
+        """
+        now = time.monotonic()
+        entry = self._locations.get(key)
+        if entry is None:
+            # The request that registered it is fetching right now, so the first refresh is a full interval away
+            entry = self._locations[key] = {"due": self._next_due(now)}
+        entry.update(fetch=fetch, cache_if=cache_if, seen=now)
+        self._locations.move_to_end(key)
+        while len(self._locations) > self.max_locations:
+            self._locations.popitem(last=False)
+
+    def _take_token(self, now):
+        capacity = max(1.0, self.per_minute / 6)
+        self._tokens = min(capacity, self._tokens + (now - self._refilled_at) * self.per_minute / 60)
+        self._refilled_at = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def _refresh(self, key, entry):
+        try:
+            value = await entry["fetch"]()
+        except Exception as exc:
+            self.failures += 1
+            log_event("weather_prefetch_failed", level=logging.WARNING, key=key, error=repr(exc))
+            return
+        if entry["cache_if"](value):
+            self.cache.put(key, value)
+            self.refreshes += 1
+        else:
+            self.failures += 1
+
+    async def run(self, tick=1.0):
+        """
+        Refreshes due locations until cancelled; start it from the app's lifespan.
+        """
+        while True:
+            now = time.monotonic()
+            for key, entry in list(self._locations.items()):
+                if entry["seen"] + self.active_for <= now:
+                    del self._locations[key]
+            due = sorted(
+                ((entry["due"], key) for key, entry in self._locations.items() if entry["due"] <= now),
+                key=lambda item: item[0],
+            )
+            refreshes = []
+            for _, key in due:
+                if not self._take_token(now):
+                    # Out of budget this tick; the most overdue locations go first next time
+                    self.deferred += 1
+                    continue
+                entry = self._locations[key]
+                entry["due"] = self._next_due(now)
+                refreshes.append(self._refresh(key, entry))
+            if refreshes:
+                await asyncio.gather(*refreshes)
+            await asyncio.sleep(tick)
+
+    def stats(self):
+        return {
+            "locations": len(self._locations),
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "deferred": self.deferred,
+            "per_minute": self.per_minute,
+        }